@@ -1,6 +1,12 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import sys
+import os
+import csv
+import zlib
+import collections
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 ####################
 # DEFAULT SETTINGS #
@@ -19,7 +25,8 @@ pure = False
 #################################
 
 def auctionSimulation(M, K, N, R, Smax, penalty=0.05,
-                      pure=False):
+                      pure=False, rng=None, historyDir=None, factorStride=None, stats=None,
+                      typeMarket=False, strategies=None):
     """Full auction simulation function
 
     Parameters:
@@ -30,58 +37,182 @@ def auctionSimulation(M, K, N, R, Smax, penalty=0.05,
     Smax -- Maximum starting price
     penalty -- Penalty factor for calculating penalties when selling back
     pure -- Boolean if the auction allows selling back
+    rng -- seed or numpy Generator, None for the global np.random state
+    historyDir -- directory to keep the histories in as memory-mapped
+                  .npy files instead of in memory
+    factorStride -- also record the bidding factors every factorStride
+                    rounds
+    stats -- True or a SimulationStats to feed instead of keeping the
+             histories; it is returned in their place. With a seed the
+             item prices are drawn round by round from a stream of
+             their own, so memory does not grow with R and keeping stats
+             or a historyDir does not change the market; the global
+             np.random state draws all R*K prices up front, as before
+    typeMarket -- market prices per item type instead of per seller; the
+                  extras then also hold per-type histories, see
+                  historyBuffers
+    strategies -- buyer strategy name for all buyers or one per buyer,
+                  see strategyMasks; None for the standard strategy
 
     Returns:
     A three tuple containing
     rStats -- Statistics of market price development over rounds
     rSellerProfit -- Profits for every seller over rounds
     rBuyersProfit -- Profits for every buyer over rounds
+    and with factorStride an extras dict, see historyBuffers
     """
     if N <= K:
         raise ValueError(
             'Error: Number of Buyers needs to be bigger than number of Sellers')
 
-    rMarketprices = [np.zeros(K)]
-    rSellerProfit = [np.zeros(K)]
-    rBuyerProfit = [np.zeros(N)]
-
-    seller2Items = assignItemToSeller(K, M)
-    valueItems = assignPriceToItem(seller2Items, R, Smax)
-    lowerDelta = np.random.uniform(0.7, 1.0, size=N)
-    higherDelta = np.random.uniform(1.0, 1.3, size=N)
-
-    biddingFactorHistory = []
-    biddingFactor = initBiddingFactor(N, K)
-    biddingFactorHistory.append(biddingFactor)
+    rBuyerProfit, rSellerProfit, rMarketprices, extras = historyBuffers(
+        K, N, R, historyDir=historyDir, factorStride=factorStride, ring=bool(stats),
+        M=M if typeMarket else None)
+    stats = SimulationStats(R) if stats is True else stats or None
+    if stats is not None:
+        stats.update(0, rBuyerProfit[0], rSellerProfit[0], rMarketprices[0])
+
+    rng = getRng(rng)
+    seller2Items = assignItemToSeller(K, M, rng)
+    # seeded runs draw the prices round by round from a child stream, so
+    # the market does not depend on how the results are kept; the global
+    # state draws them up front so that np.random.seed runs stay the same
+    priceRng = None if rng is np.random else rng.spawn(1)[0]
+    valueItems = assignPriceToItem(seller2Items, R, Smax, rng) if priceRng is None else None
+    lowerDelta = rng.uniform(0.7, 1.0, size=N)
+    higherDelta = rng.uniform(1.0, 1.3, size=N)
+
+    biddingFactor = initBiddingFactor(N, K, rng=rng)
+    recordFactors(extras, 0, biddingFactor)
+    itemTypes = None
+    population = strategyMasks(strategies, (1, N))
+    overBids = np.zeros((K, N), dtype=bool) if needsOverBids(population) else None
     for auctionRound in range(R):
+        itemPrices = (valueItems[auctionRound] if priceRng is None
+                      else assignPriceToItem(seller2Items, 1, Smax, priceRng)[0])
         # randomize order of sold items
-        auctionItemOrderInd = np.random.permutation(np.arange(K))
-        auctionItemOrder = rearangeArray(
-            valueItems[auctionRound], auctionItemOrderInd)
+        auctionItemOrderInd = rng.permutation(np.arange(K))
+        auctionItemOrder = itemPrices[auctionItemOrderInd]
         # adapt to the biddingFactors to the order the items are sold
-        biddingFactorOrder = np.array(
-            [rearangeArray(i, auctionItemOrderInd) for i in biddingFactor])
-        if not pure:
-            winners, profitsBuyer, profitsSeller, marketPrices = auctionItemsImpure(auctionItemOrder,
-                                                                                    biddingFactorOrder, penalty)
-            # BiddingFactors get updated for all buyers in every round
-            biddingFactor = updateBiddingFactorImpure(
-                biddingFactor, winners, auctionItemOrderInd, lowerDelta, higherDelta)
-        else:
-            winners, profitsBuyer, profitsSeller, marketPrices = auctionItemsPure(auctionItemOrder,
-                                                                                  biddingFactorOrder)
-            biddingFactor = updateBiddingFactorPure(
-                biddingFactor, winners, auctionItemOrderInd, lowerDelta, higherDelta)
-
-        rMarketprices.append(marketPrices)
-        rSellerProfit.append(rSellerProfit[-1]+profitsSeller)
-        rBuyerProfit.append(rBuyerProfit[-1]+profitsBuyer)
+        biddingFactorOrder = biddingFactor[:, auctionItemOrderInd]
+        if typeMarket:
+            itemTypes = seller2Items[auctionItemOrderInd]
+        winners, marketPrices, winningBids = clearRound(
+            auctionItemOrder, biddingFactorOrder, penalty, pure, itemTypes, population, overBids)
+        profitsBuyer, profitsSeller = calculateProfits(
+            list(zip(winners.tolist(), marketPrices, winningBids)), N, K, penalty)
+        # BiddingFactors get updated for all buyers in every round
+        biddingFactor = updateBiddingFactorStrategies(
+            biddingFactor, winners, auctionItemOrderInd, lowerDelta, higherDelta, population, pure,
+            overBids, rng)
+
+        row = (auctionRound + 1) % len(rBuyerProfit)
+        rMarketprices[row] = marketPrices
+        rSellerProfit[row] = rSellerProfit[row - 1]+profitsSeller
+        rBuyerProfit[row] = rBuyerProfit[row - 1]+profitsBuyer
+
+        recordFactors(extras, auctionRound + 1, biddingFactor)
+        if typeMarket:
+            recordTypes(extras, auctionRound + 1, seller2Items, itemTypes, marketPrices,
+                        winningBids, rSellerProfit[row])
+        if stats is not None:
+            stats.update(auctionRound + 1, rBuyerProfit[row], rSellerProfit[row], marketPrices)
+    return simulationResult(rBuyerProfit, rSellerProfit, rMarketprices, extras, stats)
+
+
+def auctionSimulationBatch(M, K, N, R, Smax, B, penalty=0.05, pure=False, rng=None,
+                           historyDir=None, factorStride=None, stats=None, typeMarket=False,
+                           strategies=None):
+    """Simulate B independent markets at once
+
+    Same market as auctionSimulation, with the bidding factors of all
+    replicas in one (B, N, K) array, a random item order per replica
+    and round and the rounds cleared by clearRoundBatch.
 
-        biddingFactorHistory.append(biddingFactor)
-    return rBuyerProfit, rSellerProfit, rMarketprices
+    Parameters:
+    M -- The amount of types of items
+    K -- The amount of sellers
+    N -- The amount of buyers
+    R -- The amount of bidding rounds
+    Smax -- Maximum starting price
+    B -- The amount of replicas
+    penalty -- Penalty factor for calculating penalties when selling back
+    pure -- Boolean if the auction allows selling back
+    rng -- seed or numpy Generator, None for the global np.random state;
+           all replicas draw from this one stream in vectorized calls,
+           so the market of a replica changes with B. Replicas that must
+           not depend on each other need runs with their own seeds, as
+           the configurations of sweep get
+    historyDir -- directory to keep the histories in as memory-mapped
+                  .npy files instead of in memory
+    factorStride -- also record the bidding factors every factorStride
+                    rounds
+    stats -- True or a SimulationStats to feed instead of keeping the
+             histories; it is returned in their place
+    typeMarket -- market prices per item type instead of per seller; the
+                  extras then also hold per-type histories, see
+                  historyBuffers
+    strategies -- buyer strategy name for all buyers, or one per buyer
+                  (N,) or per replica and buyer (B, N), see strategyMasks
 
+    Returns:
+    A three tuple of arrays, indexed like auctionSimulation per replica
+    rBuyerProfit -- Profits for every buyer over rounds (B, R+1, N)
+    rSellerProfit -- Profits for every seller over rounds (B, R+1, K)
+    rMarketprices -- Market prices over rounds, in sale order (B, R+1, K)
+    and with factorStride an extras dict, see historyBuffers
+    """
+    if N <= K:
+        raise ValueError(
+            'Error: Number of Buyers needs to be bigger than number of Sellers')
 
-def auctionItemsImpure(itemStartingprice, biddingFactorAlpha, penalty=0.05):
+    rBuyerProfit, rSellerProfit, rMarketprices, extras = historyBuffers(
+        K, N, R, B, historyDir, factorStride, ring=bool(stats), M=M if typeMarket else None)
+    stats = SimulationStats(R) if stats is True else stats or None
+    if stats is not None:
+        stats.update(0, rBuyerProfit[:, 0], rSellerProfit[:, 0], rMarketprices[:, 0])
+
+    rng = getRng(rng)
+    seller2Items = assignItemToSeller((B, K), M, rng) if typeMarket else None
+    itemTypes = None
+    lowerDelta = rng.uniform(0.7, 1.0, size=(B, N))
+    higherDelta = rng.uniform(1.0, 1.3, size=(B, N))
+    biddingFactor = initBiddingFactor(N, K, B, rng)
+    recordFactors(extras, 0, biddingFactor)
+    population = strategyMasks(strategies, (B, N))
+    overBids = np.zeros((B, K, N), dtype=bool) if needsOverBids(population) else None
+    for auctionRound in range(R):
+        # prices are drawn round by round, so memory does not grow with R
+        itemPrices = np.round(rng.uniform(size=(B, K), low=0, high=Smax), decimals=2)
+        # randomize order of sold items, per replica
+        auctionItemOrderInd = np.argsort(rng.random((B, K)), axis=-1)
+        auctionItemOrder = np.take_along_axis(itemPrices, auctionItemOrderInd, axis=-1)
+        biddingFactorOrder = np.take_along_axis(
+            biddingFactor, auctionItemOrderInd[:, None, :], axis=-1)
+        if typeMarket:
+            itemTypes = np.take_along_axis(seller2Items, auctionItemOrderInd, axis=-1)
+        winners, marketPrices, winningBids = clearRoundBatch(
+            auctionItemOrder, biddingFactorOrder, penalty, pure, itemTypes, population, overBids)
+        profitsBuyer, profitsSeller = calculateProfitsBatch(
+            winners, marketPrices, winningBids, N, penalty)
+        biddingFactor = updateBiddingFactorStrategies(
+            biddingFactor, winners, auctionItemOrderInd, lowerDelta, higherDelta, population, pure,
+            overBids, rng)
+
+        row = (auctionRound + 1) % rBuyerProfit.shape[1]
+        rMarketprices[:, row] = marketPrices
+        rSellerProfit[:, row] = rSellerProfit[:, row - 1] + profitsSeller
+        rBuyerProfit[:, row] = rBuyerProfit[:, row - 1] + profitsBuyer
+        recordFactors(extras, auctionRound + 1, biddingFactor)
+        if typeMarket:
+            recordTypes(extras, auctionRound + 1, seller2Items, itemTypes, marketPrices,
+                        winningBids, rSellerProfit[:, row])
+        if stats is not None:
+            stats.update(auctionRound + 1, rBuyerProfit[:, row], rSellerProfit[:, row], marketPrices)
+    return simulationResult(rBuyerProfit, rSellerProfit, rMarketprices, extras, stats)
+
+
+def auctionItemsImpure(itemStartingprice, biddingFactorAlpha, penalty=0.05, itemTypes=None):
     """One round of impure auctions
 
     It needs to return after every iteration (round) the values needed
@@ -91,39 +222,23 @@ def auctionItemsImpure(itemStartingprice, biddingFactorAlpha, penalty=0.05):
     Parameters:
     itemStartingprice -- array of itemprices for every seller
     biddingFactorAlpha --
+    itemTypes -- item types in the same order, for per-type market prices
 
     Returns:
     (new starting price, new bidding factors,
      total buyer profit, total seller profit, market history)
 
     """
-    auctionRounds = []
-    bids = biddingFactorAlpha * itemStartingprice
-    winners = []
-    for i, item in enumerate(itemStartingprice):
-        for winnerInd, marketPrice, winningBid in auctionRounds:
-            bids[winnerInd, i] = max(
-                bids[winnerInd, i], item + (marketPrice - winningBid) + winningBid*penalty)
-        marketPrice = computeMarketPrice(bids, i)
-        sortedBids = sorted(bids[:, i][bids[:, i] < marketPrice])
-        winner = sortedBids[-1]
-        winnerInd = np.where(bids[:, i] == winner)[0][0]
-        winners.append(winnerInd)
-
-        if len(sortedBids) > 1:
-            winnerToPay = sortedBids[-2]
-        else:
-            winnerToPay = item
-
-        auctionRounds.append([winnerInd, marketPrice, winnerToPay])
-
+    winners, marketPrices, winningBids = clearRound(
+        itemStartingprice, biddingFactorAlpha, penalty, itemTypes=itemTypes)
+    auctionRounds = list(zip(winners.tolist(), marketPrices, winningBids))
     profitBuyer, profitSeller = calculateProfits(auctionRounds, len(
         biddingFactorAlpha), len(biddingFactorAlpha[1]), penalty)
 
-    return winners, profitBuyer, profitSeller, np.array(auctionRounds)[:, 1]
+    return winners.tolist(), profitBuyer, profitSeller, marketPrices
 
 
-def auctionItemsPure(itemStartingprice, biddingFactorAlpha):
+def auctionItemsPure(itemStartingprice, biddingFactorAlpha, itemTypes=None):
     """One round of pure auctions
 
     It needs to return after every iteration (round) the values needed
@@ -133,57 +248,193 @@ def auctionItemsPure(itemStartingprice, biddingFactorAlpha):
     Parameters:
     itemStartingprice -- array of itemprices for every seller
     biddingFactorAlpha --
+    itemTypes -- item types in the same order, for per-type market prices
 
     Returns:
     (new starting price, new bidding factors,
      total buyer profit, total seller profit, market history)
 
     """
-    auctionRounds = []
-    bids = biddingFactorAlpha * itemStartingprice
-    winners = []
-    for i, item in enumerate(itemStartingprice):
-        bidsNonWinners = np.array(
-            [b for i, b in enumerate(bids) if i not in winners])
-        marketPrice = computeMarketPrice(bidsNonWinners, i)
-        sortedBids = sorted(
-            bidsNonWinners[:, i][bidsNonWinners[:, i] < marketPrice])
-        winner = sortedBids[-1]
-        winnerInd = np.where(bids[:, i] == winner)[0][0]
-        winners.append(winnerInd)
-
-        if len(sortedBids) > 1:
-            winnerToPay = sortedBids[-2]
-        else:
-            winnerToPay = item
-
-        auctionRounds.append([winnerInd, marketPrice, winnerToPay])
+    winners, marketPrices, winningBids = clearRound(
+        itemStartingprice, biddingFactorAlpha, pure=True, itemTypes=itemTypes)
+    auctionRounds = list(zip(winners.tolist(), marketPrices, winningBids))
     # after auction ends: calculate profits
     profitBuyer, profitSeller = calculateProfits(auctionRounds, len(
         biddingFactorAlpha), len(biddingFactorAlpha[1]), penalty)
 
-    return winners, profitBuyer, profitSeller, np.array(auctionRounds)[:, 1]
+    return winners.tolist(), profitBuyer, profitSeller, marketPrices
 
 
-def calculateProfits(auctionRounds, numBuyers, numSellers, penalty):
-    """Calculate profits for buyers and sellers"""
-    profitBuyer = np.zeros(numBuyers)
-    profitSeller = np.zeros(numSellers)
-    for seller, [winnerInd, marketPrice, winningBid] in enumerate(auctionRounds):
-        if profitBuyer[winnerInd] == 0:
-            profitSeller[seller] += winningBid
-            profitBuyer[winnerInd] = marketPrice - winningBid
+def clearRound(itemStartingprice, biddingFactorAlpha, penalty=0.05, pure=False, itemTypes=None,
+               strategies=None, overBids=None):
+    """Auction all items of one round, in the given order
+
+    Parameters:
+    itemStartingprice -- array of itemprices for every seller
+    biddingFactorAlpha -- bidding factors (buyers, sellers), same order
+    penalty -- penalty factor, only used by impure auctions
+    pure -- Boolean if buyers stop bidding after a win
+    itemTypes -- item type per seller, same order, for per-type market
+                 prices (see clearRoundBatch)
+    strategies -- buyer strategies, see clearRoundBatch
+    overBids -- optional (sellers, buyers) boolean array, filled with the
+                over-bids (see clearRoundBatch)
+
+    Returns:
+    (winners, marketPrices, winningBids) arrays with one entry per item
+    """
+    if itemTypes is not None:
+        itemTypes = np.asarray(itemTypes)[None]
+    if overBids is not None:
+        overBids = overBids[None]
+    winners, marketPrices, winningBids = clearRoundBatch(
+        np.asarray(itemStartingprice, dtype=float)[None], np.asarray(biddingFactorAlpha)[None],
+        penalty, pure, itemTypes, strategies, overBids)
+    return winners[0], marketPrices[0], winningBids[0]
+
+
+def clearRoundBatch(itemStartingprice, biddingFactorAlpha, penalty=0.05, pure=False,
+                    itemTypes=None, strategies=None, overBids=None):
+    """Auction all items of one round in many replicas, in the given order
+
+    Every item costs O(N) work per replica: the market price is the
+    mean of the bids, the winner is the highest bid below it (lowest
+    buyer index on ties) and pays the second highest one, found with a
+    partition. In impure auctions the buyers who already won adjust their
+    bids first, with the adjustBids kernel of their strategy (see
+    BUYER_STRATEGIES). In pure auctions previous winners are left out of
+    the market price and the winner. If no bid is below the market price, because all bids are
+    equal, the lowest bids compete instead.
+
+    With itemTypes the market price is the mean of the current bids on
+    all items of the same type instead of on this item alone. The bid
+    sums per type are kept up to date with np.bincount, so this costs
+    O(N + K) per item.
+
+    Parameters:
+    itemStartingprice -- itemprices per replica and seller (replicas, sellers)
+    biddingFactorAlpha -- bidding factors (replicas, buyers, sellers), same order
+    penalty -- penalty factor, only used by impure auctions
+    pure -- Boolean if buyers stop bidding after a win
+    itemTypes -- item type per replica and seller (replicas, sellers), same order
+    strategies -- buyer strategies as accepted by strategyMasks, or the
+                  dict it returns; None for the standard strategy
+    overBids -- optional (replicas, sellers, buyers) boolean array, filled
+                with the bidding buyers at or above the market price of
+                the item sold at every position
+
+    Returns:
+    (winners, marketPrices, winningBids) arrays (replicas, sellers)
+    """
+    # one contiguous row of bids per replica and item
+    bids = np.ascontiguousarray(
+        np.swapaxes(biddingFactorAlpha * itemStartingprice[:, None, :], 1, 2))
+    numReplicas, numSellers, numBuyers = bids.shape
+    replicas = np.arange(numReplicas)
+    winners = np.zeros((numReplicas, numSellers), dtype=np.intp)
+    marketPrices = np.zeros((numReplicas, numSellers))
+    winningBids = np.zeros((numReplicas, numSellers))
+    bidding = np.ones((numReplicas, numBuyers), dtype=bool)
+    if not isinstance(strategies, dict):
+        strategies = strategyMasks(strategies, (numReplicas, numBuyers))
+    if itemTypes is not None:
+        itemTypes = np.broadcast_to(itemTypes, (numReplicas, numSellers))
+        columnSums = np.sum(bids, axis=-1)
+        typeCounts, typeSums = typeAggregates(itemTypes, columnSums)
+    for i in range(numSellers):
+        item = itemStartingprice[:, i]
+        itemBids = bids[:, i]
+        if not pure and i:
+            for name, mask in strategies.items():
+                BUYER_STRATEGIES[name].adjustBids(itemBids, item, winners[:, :i], marketPrices[:, :i],
+                                                  winningBids[:, :i], penalty, mask)
+        if itemTypes is not None:
+            itemType = itemTypes[:, i]
+            if not pure:
+                columnSum = np.sum(itemBids, axis=-1)
+                typeSums[replicas, itemType] += columnSum - columnSums[:, i]
+                columnSums[:, i] = columnSum
+            # every replica has exactly i previous winners in pure auctions
+            activeBuyers = numBuyers - i if pure else numBuyers
+            marketPrice = typeSums[replicas, itemType] / (typeCounts[replicas, itemType] * activeBuyers)
+        elif pure:
+            marketPrice = np.mean(itemBids[bidding].reshape(numReplicas, -1), axis=-1)
         else:
-            profitSeller[seller] += winningBid
-            oldWinningBid = 0
-            oldSeller = 0
-            for oldS, r in enumerate(auctionRounds[:seller]):
-                if r[0] == winnerInd:
-                    oldWinningBid = r[2]
-                    oldSeller = oldS
-            fee = oldWinningBid*penalty
-            profitBuyer[winnerInd] = marketPrice - winningBid - fee
-            profitSeller[oldSeller] += fee - oldWinningBid
+            marketPrice = np.mean(itemBids, axis=-1)
+        eligible = bidding & (itemBids < marketPrice[:, None])
+        if overBids is not None:
+            overBids[:, i] = bidding & ~eligible
+        numEligible = np.count_nonzero(eligible, axis=-1)
+        if not np.all(numEligible):
+            # all bids equal (e.g. an item priced 0): the lowest bids compete
+            lowest = np.min(np.where(bidding, itemBids, np.inf), axis=-1)
+            stuck = numEligible == 0
+            eligible[stuck] = bidding[stuck] & (itemBids[stuck] <= lowest[stuck, None])
+            numEligible = np.count_nonzero(eligible, axis=-1)
+        candidates = np.where(eligible, itemBids, -np.inf)
+        winners[:, i] = np.argmax(candidates, axis=-1)
+        secondBids = np.partition(candidates, numBuyers - 2, axis=-1)[:, numBuyers - 2]
+        winningBids[:, i] = np.where(numEligible > 1, secondBids, item)
+        marketPrices[:, i] = marketPrice
+        bidding[replicas, winners[:, i]] = not pure
+        if pure and itemTypes is not None:
+            # the winner's bids leave the type sums
+            typeSums -= typeAggregates(itemTypes, bids[replicas, :, winners[:, i]],
+                                       typeSums.shape[-1])[1]
+
+    return winners, marketPrices, winningBids
+
+
+def calculateProfits(auctionRounds, numBuyers, numSellers, penalty):
+    """Calculate profits for buyers and sellers
+
+    auctionRounds holds [winnerInd, marketPrice, winningBid] for every
+    seller in the order the items were sold. See calculateProfitsBatch.
+    """
+    winners, marketPrices, winningBids = np.array(auctionRounds, dtype=float).T
+    profitBuyer, profitSeller = calculateProfitsBatch(
+        winners[None].astype(np.intp), marketPrices[None], winningBids[None], numBuyers, penalty)
+    return profitBuyer[0], profitSeller[0]
+
+
+def calculateProfitsBatch(winners, marketPrices, winningBids, numBuyers, penalty):
+    """Settle one round of many simulation replicas at once
+
+    Every buyer holds at most one item: the last one it won, kept as
+    (seller, paid price) in per-buyer arrays, seller -1 while it holds
+    nothing. When a holder wins again the
+    held item is sold back, the buyer pays winningBid*penalty to its
+    seller and that seller refunds the old winning bid. Work is linear in
+    the number of sellers.
+
+    Parameters:
+    winners -- winning buyer per replica and item (replicas, sellers)
+    marketPrices -- market price per replica and item (replicas, sellers)
+    winningBids -- price paid per replica and item (replicas, sellers)
+    numBuyers -- amount of buyers
+    penalty -- penalty factor for selling back
+
+    Returns:
+    (profitBuyer (replicas, buyers), profitSeller (replicas, sellers))
+    """
+    numReplicas, numSellers = winners.shape
+    replicas = np.arange(numReplicas)
+    profitBuyer = np.zeros((numReplicas, numBuyers))
+    profitSeller = np.zeros((numReplicas, numSellers))
+    heldSeller = np.full((numReplicas, numBuyers), -1, dtype=np.intp)
+    heldBid = np.zeros((numReplicas, numBuyers))
+    for seller in range(numSellers):
+        winnerInd = winners[:, seller]
+        winningBid = winningBids[:, seller]
+        profitSeller[:, seller] += winningBid
+        oldSeller = heldSeller[replicas, winnerInd]
+        resold = oldSeller >= 0
+        oldWinningBid = np.where(resold, heldBid[replicas, winnerInd], 0)
+        fee = oldWinningBid*penalty
+        profitBuyer[replicas, winnerInd] = marketPrices[:, seller] - winningBid - fee
+        profitSeller[replicas[resold], oldSeller[resold]] += (fee - oldWinningBid)[resold]
+        heldSeller[replicas, winnerInd] = seller
+        heldBid[replicas, winnerInd] = winningBid
     return profitBuyer, profitSeller
 
 
@@ -202,38 +453,223 @@ def updateBiddingFactorImpure(biddingFactor, winnerIDs, sellerIDs, lowerDelta, h
     # NOTE: in "pure" auctions update only if buyer has not won yet
     # --> (because if a buyer has won he does not bid anymore)
     """
-    for winner, seller in enumerate(sellerIDs):
-        nonWinners = [i for i in range(
-            len(biddingFactor)) if i != winnerIDs[winner]]
-        biddingFactor[winnerIDs[winner],
-                      seller] *= lowerDelta[winnerIDs[winner]]
-        biddingFactor[nonWinners, seller] *= higherDelta[nonWinners]
-
-    return biddingFactor
+    return updateBiddingFactorBatch(biddingFactor, winnerIDs, sellerIDs, lowerDelta, higherDelta)
 
 
 def updateBiddingFactorPure(biddingFactor, winnerIDs, sellerIDs, lowerDelta, higherDelta):
     """Bidding factor update for pure auction"""
-    for winner, seller in enumerate(sellerIDs):
-        currentWinner = winnerIDs[winner]
-        # update winner
-        biddingFactor[currentWinner, seller] *= lowerDelta[currentWinner]
-        # update all who have not won yet
-        nonWinners = [i for i in range(
-            len(biddingFactor)) if i != winnerIDs[winner] or i in winnerIDs[:winner]]
-        biddingFactor[nonWinners, seller] *= higherDelta[nonWinners]
+    return updateBiddingFactorBatch(biddingFactor, winnerIDs, sellerIDs, lowerDelta, higherDelta,
+                                    pure=True)
 
-    return biddingFactor
+
+def updateBiddingFactorBatch(biddingFactor, winnerIDs, sellerIDs, lowerDelta, higherDelta,
+                             pure=False, overBids=None, rng=None, mask=None):
+    """Update the bidding factors of one or many replicas in place
+
+    The winner of the item at position p in the sale order gets its
+    factor for seller sellerIDs[p] multiplied by its lowerDelta, every
+    other buyer by its higherDelta. In pure auctions a buyer that wins
+    a second time also gets its higherDelta. With overBids, non-winners
+    that over-bid are reset to a uniform draw from [1, factor), as in
+    strategy two; values are drawn replica by replica, then by position
+    and buyer. With a mask only those buyers are updated.
+
+    Parameters:
+    biddingFactor -- factors (..., buyers, sellers), updated in place if
+                     it is contiguous
+    winnerIDs -- winning buyer per position in the sale order (..., sellers)
+    sellerIDs -- seller per position in the sale order (..., sellers)
+    lowerDelta -- bid decrease factor per buyer (..., buyers)
+    higherDelta -- bid increase factor per buyer (..., buyers)
+    pure -- Boolean if this was a pure auction
+    overBids -- boolean mask (..., sellers, buyers) of over-bids per
+                position in the sale order, see clearRoundBatch
+    rng -- seed or numpy Generator for the over-bid draws, None for the
+           global np.random state
+    mask -- boolean mask (..., buyers) of the buyers to update, None
+            for all
+
+    Returns:
+    biddingFactor
+    """
+    numBuyers, numSellers = biddingFactor.shape[-2:]
+    factors = biddingFactor.reshape(-1, numBuyers, numSellers)
+    winnerIDs = np.asarray(winnerIDs).reshape(-1, numSellers)
+    sellerIDs = np.broadcast_to(sellerIDs, winnerIDs.shape)
+    lowerDelta = np.broadcast_to(lowerDelta, (len(factors), numBuyers))
+    higherDelta = np.broadcast_to(higherDelta, (len(factors), numBuyers))
+    replicas = np.arange(len(factors))[:, None]
+
+    won = factors[replicas, winnerIDs, sellerIDs]
+    if mask is None:
+        factors *= higherDelta[:, :, None]
+        factors[replicas, winnerIDs, sellerIDs] = won * lowerDelta[replicas, winnerIDs]
+    else:
+        mask = np.broadcast_to(mask, (len(factors), numBuyers))
+        factors *= np.where(mask, higherDelta, 1.0)[:, :, None]
+        factors[replicas, winnerIDs, sellerIDs] = np.where(
+            mask[replicas, winnerIDs], won * lowerDelta[replicas, winnerIDs], won)
+    if pure:
+        order = np.argsort(winnerIDs, axis=-1, kind='stable')
+        sortedIDs = np.take_along_axis(winnerIDs, order, axis=-1)
+        again = np.zeros(winnerIDs.shape, dtype=bool)
+        np.put_along_axis(again, order[:, 1:], sortedIDs[:, 1:] == sortedIDs[:, :-1], axis=-1)
+        if mask is not None:
+            again &= mask[replicas, winnerIDs]
+        r, p = np.nonzero(again)
+        factors[r, winnerIDs[r, p], sellerIDs[r, p]] *= higherDelta[r, winnerIDs[r, p]]
+    if overBids is not None:
+        reset = np.array(overBids, dtype=bool).reshape(-1, numSellers, numBuyers)
+        reset[replicas, np.arange(numSellers), winnerIDs] = False
+        if mask is not None:
+            reset &= mask[:, None, :]
+        r, p, n = np.nonzero(reset)
+        if len(r):
+            # as np.random.uniform, but a factor below 1 is allowed as high
+            high = factors[r, n, sellerIDs[r, p]]
+            factors[r, n, sellerIDs[r, p]] = 1.0 + (high - 1.0) * getRng(rng).random(len(r))
+    return factors.reshape(biddingFactor.shape)
 
 
 ##################################
 # ALTERNATIVE STRATEGY FUNCTIONS #
 ##################################
 
+BuyerStrategy = collections.namedtuple('BuyerStrategy', ['adjustBids', 'updateFactors', 'overBids'])
+
+
+def raiseResaleBids(itemBids, item, winners, marketPrices, winningBids, penalty, mask=None):
+    """Standard bid adjustment of previous winners, in place
+
+    A buyer who won item j bids at least
+    item + (marketPrice_j - winningBid_j) + winningBid_j*penalty,
+    applied with one np.maximum.at over the previous wins.
+
+    Parameters:
+    itemBids -- bids on the current item (replicas, buyers)
+    item -- price of the current item per replica (replicas,)
+    winners -- previous winners in sale order (replicas, previous items)
+    marketPrices -- their market prices (replicas, previous items)
+    winningBids -- their winning bids (replicas, previous items)
+    penalty -- penalty factor for selling back
+    mask -- boolean mask (replicas, buyers) of the buyers using this
+            strategy, None for all
+    """
+    replicas = np.broadcast_to(np.arange(len(itemBids))[:, None], winners.shape)
+    values = item[:, None] + (marketPrices - winningBids) + winningBids*penalty
+    if mask is not None:
+        own = mask[replicas, winners]
+        replicas, winners, values = replicas[own], winners[own], values[own]
+    np.maximum.at(itemBids, (replicas, winners), values)
+
+
+def discountResaleBids(itemBids, item, winners, marketPrices, winningBids, penalty, mask=None):
+    """Bid adjustment of strategies one and two, in place
+
+    A buyer who won item j lowers its bid by
+    (marketPrice_j - winningBid_j) + winningBid_j*penalty, for every
+    previous win in sale order. See raiseResaleBids for the parameters.
+    """
+    replicas = np.broadcast_to(np.arange(len(itemBids))[:, None], winners.shape)
+    losses = np.stack([marketPrices - winningBids, winningBids*penalty], axis=-1)
+    if mask is not None:
+        own = mask[replicas, winners]
+        replicas, winners, losses = replicas[own], winners[own], losses[own]
+    # both terms in turn, so the rounding is that of the original loop
+    np.subtract.at(itemBids, (np.repeat(replicas, 2), np.repeat(winners, 2)), losses.ravel())
+
+
+def updateStandardFactors(biddingFactor, winnerIDs, sellerIDs, lowerDelta, higherDelta, pure=False,
+                          overBids=None, rng=None, mask=None):
+    """Standard bidding factor update, see updateBiddingFactorBatch"""
+    return updateBiddingFactorBatch(biddingFactor, winnerIDs, sellerIDs, lowerDelta, higherDelta,
+                                    pure, mask=mask)
+
+
+def updateOverBidFactors(biddingFactor, winnerIDs, sellerIDs, lowerDelta, higherDelta, pure=False,
+                         overBids=None, rng=None, mask=None):
+    """Bidding factor update of strategy two, see updateBiddingFactorBatch"""
+    return updateBiddingFactorBatch(biddingFactor, winnerIDs, sellerIDs, lowerDelta, higherDelta,
+                                    pure, overBids, rng, mask)
 
-def auctionSimulationStrats(M, K, N, R, Smax, penalty=0.05, one=False):
+
+# name -> BuyerStrategy(adjustBids, updateFactors, overBids), see registerStrategy
+BUYER_STRATEGIES = {
+    'standard': BuyerStrategy(raiseResaleBids, updateStandardFactors, False),
+    'one': BuyerStrategy(discountResaleBids, updateStandardFactors, False),
+    'two': BuyerStrategy(discountResaleBids, updateOverBidFactors, True),
+}
+
+
+def registerStrategy(name, adjustBids, updateFactors, overBids=False):
+    """Make a buyer strategy available by name
+
+    Parameters:
+    name -- name of the strategy, as used in strategies arguments
+    adjustBids -- kernel adjusting the bids of previous winners in place,
+                  with the signature of raiseResaleBids
+    updateFactors -- kernel updating the bidding factors after a round,
+                     with the signature of updateStandardFactors
+    overBids -- Boolean if updateFactors needs the over-bids of the round
+    """
+    BUYER_STRATEGIES[name] = BuyerStrategy(adjustBids, updateFactors, overBids)
+
+
+def strategyMasks(strategies, shape):
+    """Split a population of buyers by strategy
+
+    Parameters:
+    strategies -- None or a strategy name for all buyers, or a name per
+                  buyer (buyers,) or per replica and buyer (replicas, buyers)
+    shape -- (replicas, buyers) of the market
+
+    Returns:
+    dict of strategy name to boolean mask (replicas, buyers), the mask
+    is None when all buyers use the strategy
+    """
+    if strategies is None:
+        strategies = 'standard'
+    if isinstance(strategies, str):
+        masks = {strategies: None}
+    else:
+        strategies = np.asarray(strategies)
+        if strategies.shape not in (tuple(shape), tuple(shape)[-1:]):
+            raise ValueError(f'Expected a strategy per buyer {tuple(shape)[-1:]} or per replica '
+                             f'and buyer {tuple(shape)}, got {strategies.shape}')
+        strategies = np.broadcast_to(strategies, shape)
+        masks = {str(name): strategies == name for name in np.unique(strategies)}
+        if len(masks) == 1:
+            masks = dict.fromkeys(masks)
+    unknown = set(masks) - set(BUYER_STRATEGIES)
+    if unknown:
+        raise ValueError(f'Unknown buyer strategies: {sorted(unknown)}')
+    return masks
+
+
+def needsOverBids(strategies):
+    """Boolean if any of the strategies (see strategyMasks) needs over-bids"""
+    return any(BUYER_STRATEGIES[name].overBids for name in strategies)
+
+
+def updateBiddingFactorStrategies(biddingFactor, winnerIDs, sellerIDs, lowerDelta, higherDelta,
+                                  strategies, pure=False, overBids=None, rng=None):
+    """Update the bidding factors of every buyer with its own strategy
+
+    strategies is the dict of strategyMasks, the other parameters are
+    those of updateBiddingFactorBatch.
+    """
+    for name, mask in strategies.items():
+        biddingFactor = BUYER_STRATEGIES[name].updateFactors(
+            biddingFactor, winnerIDs, sellerIDs, lowerDelta, higherDelta, pure, overBids, rng, mask)
+    return biddingFactor
+
+
+def auctionSimulationStrats(M, K, N, R, Smax, penalty=0.05, one=False, rng=None,
+                            historyDir=None, factorStride=None, stats=None):
     """Full auction simulation function using alternate strategies
 
+    All buyers use strategy one or two, see auctionSimulation.
+
     Parameters:
     M -- The amount of types of items
     K -- The amount of sellers
@@ -242,137 +678,783 @@ def auctionSimulationStrats(M, K, N, R, Smax, penalty=0.05, one=False):
     Smax -- Maximum starting price
     penalty -- Penalty factor for calculating penalties when selling back
     one -- should use alternative strat one or two
+    rng -- seed or numpy Generator, None for the global np.random state
+    historyDir -- directory to keep the histories in as memory-mapped
+                  .npy files instead of in memory
+    factorStride -- also record the bidding factors every factorStride
+                    rounds
+    stats -- True or a SimulationStats to feed instead of keeping the
+             histories; it is returned in their place
 
     Returns:
     A three tuple containing
     rStats -- Statistics of market price development over rounds
     rSellerProfit -- Profits for every seller over rounds
     rBuyersProfit -- Profits for every buyer over rounds
+    and with factorStride an extras dict, see historyBuffers
     """
-    if N < K:
-        raise ValueError(
-            'Error: Number of Buyers needs to be bigger than number of Sellers')
+    return auctionSimulation(M, K, N, R, Smax, penalty, rng=rng, historyDir=historyDir,
+                             factorStride=factorStride, stats=stats,
+                             strategies='one' if one else 'two')
 
-    rMarketprices = [np.zeros(K)]
-    rSellerProfit = [np.zeros(K)]
-    rBuyerProfit = [np.zeros(N)]
 
-    seller2Items = assignItemToSeller(K, M)
-    valueItems = assignPriceToItem(seller2Items, R, Smax)
-    lowerDelta = np.random.uniform(0.7, 1.0, size=N)
-    higherDelta = np.random.uniform(1.0, 1.3, size=N)
+def auctionItemsStratOne(itemStartingprice, biddingFactorAlpha, penalty=0.05):
+    """Aution round for strategy 1"""
+    winners, marketPrices, winningBids = clearRound(
+        itemStartingprice, biddingFactorAlpha, penalty, strategies='one')
+    auctionRounds = list(zip(winners.tolist(), marketPrices, winningBids))
+    profitBuyer, profitSeller = calculateProfits(auctionRounds, len(
+        biddingFactorAlpha), len(biddingFactorAlpha[1]), penalty)
+
+    return winners.tolist(), profitBuyer, profitSeller, marketPrices
+
+
+def auctionItemsStratTwo(itemStartingprice, biddingFactorAlpha, penalty=0.05):
+    """Auction round for strategy 2
+
+    Also returns overBidsRounds, the buyers that bid at or above the
+    market price for every position in the sale order.
+    """
+    overBids = np.zeros(np.shape(biddingFactorAlpha)[::-1], dtype=bool)
+    winners, marketPrices, winningBids = clearRound(
+        itemStartingprice, biddingFactorAlpha, penalty, strategies='two', overBids=overBids)
+    auctionRounds = list(zip(winners.tolist(), marketPrices, winningBids))
+    profitBuyer, profitSeller = calculateProfits(auctionRounds, len(
+        biddingFactorAlpha), len(biddingFactorAlpha[1]), penalty)
+    overBidsRounds = [np.flatnonzero(overBidders).tolist() for overBidders in overBids]
+
+    return winners.tolist(), profitBuyer, profitSeller, marketPrices, overBidsRounds
+
+
+def updateBiddingFactorStratTwo(biddingFactor, winnerIDs, sellerIDs, lowerDelta, higherDelta, overBidsRounds,
+                                rng=None):
+    """Bidding factor update for strategy 2"""
+    overBids = np.zeros((len(overBidsRounds), len(biddingFactor)), dtype=bool)
+    for position, overBidders in enumerate(overBidsRounds):
+        overBids[position, overBidders] = True
+    return updateBiddingFactorBatch(biddingFactor, winnerIDs, sellerIDs, lowerDelta, higherDelta,
+                                    overBids=overBids, rng=rng)
 
-    biddingFactorHistory = []
-    biddingFactor = initBiddingFactor(N, K)
-    biddingFactorHistory.append(biddingFactor)
+
+########################
+# SPARSE PARTICIPATION #
+########################
+
+def auctionSimulationSparse(M, K, N, R, Smax, degree=5, penalty=0.05, pure=False, rng=None,
+                            historyDir=None, stats=None, participation=None):
+    """Auction simulation where every buyer only bids on a few sellers
+
+    Same market as auctionSimulation, but the bidding factors only exist
+    for the (buyer, seller) pairs in the participation, one per entry of
+    the buyers array of initParticipation. Memory and work per round are
+    O(N + K + participations) instead of O(N*K), so markets with
+    millions of buyers fit. An item without (bidding) participants is
+    not sold: its market price is its starting price and its seller
+    earns nothing.
+
+    Parameters:
+    M -- The amount of types of items
+    K -- The amount of sellers
+    N -- The amount of buyers
+    R -- The amount of bidding rounds
+    Smax -- Maximum starting price
+    degree -- The amount of sellers every buyer bids on
+    penalty -- Penalty factor for calculating penalties when selling back
+    pure -- Boolean if the auction allows selling back
+    rng -- seed or numpy Generator, None for the global np.random state
+    historyDir -- directory to keep the histories in as memory-mapped
+                  .npy files instead of in memory
+    stats -- True or a SimulationStats to feed instead of keeping the
+             histories; it is returned in their place
+    participation -- (indptr, buyers) to use instead of a random one,
+                     see initParticipation
+
+    Returns:
+    A three tuple containing, as auctionSimulation
+    rBuyerProfit -- Profits for every buyer over rounds (R+1, N)
+    rSellerProfit -- Profits for every seller over rounds (R+1, K)
+    rMarketprices -- Market prices over rounds, in sale order (R+1, K)
+    """
+    rBuyerProfit, rSellerProfit, rMarketprices, extras = historyBuffers(
+        K, N, R, historyDir=historyDir, ring=bool(stats))
+    stats = SimulationStats(R) if stats is True else stats or None
+    if stats is not None:
+        stats.update(0, rBuyerProfit[0], rSellerProfit[0], rMarketprices[0])
+
+    rng = getRng(rng)
+    seller2Items = assignItemToSeller(K, M, rng)
+    # the prices are drawn round by round, so memory does not grow with R
+    priceRng = rng if rng is np.random else rng.spawn(1)[0]
+    lowerDelta = rng.uniform(0.7, 1.0, size=N)
+    higherDelta = rng.uniform(1.0, 1.3, size=N)
+
+    if participation is None:
+        participation = initParticipation(N, K, degree, rng)
+    indptr, buyers = participation
+    if len(indptr) != K + 1 or len(buyers) != indptr[-1]:
+        raise ValueError('Participation does not match the amount of sellers')
+    biddingFactor = rng.uniform(low=1.0, high=1.9, size=len(buyers))
     for auctionRound in range(R):
+        itemPrices = assignPriceToItem(seller2Items, 1, Smax, priceRng)[0]
         # randomize order of sold items
-        auctionItemOrderInd = np.random.permutation(np.arange(K))
-        auctionItemOrder = rearangeArray(
-            valueItems[auctionRound], auctionItemOrderInd)
-        # adapt to the biddingFactors to the order the items are sold
-        biddingFactorOrder = np.array(
-            [rearangeArray(i, auctionItemOrderInd) for i in biddingFactor])
-        if one:
-            winners, profitsBuyer, profitsSeller, marketPrices = auctionItemsStratOne(auctionItemOrder,
-                                                                                      biddingFactorOrder, penalty)
-            # BiddingFactors get updated for all buyers in every round
-            biddingFactor = updateBiddingFactorImpure(
-                biddingFactor, winners, auctionItemOrderInd, lowerDelta, higherDelta)
+        auctionItemOrderInd = rng.permutation(np.arange(K))
+        winners, marketPrices, winningBids, winnerEntries = clearRoundSparse(
+            itemPrices, auctionItemOrderInd, indptr, buyers, biddingFactor, N,
+            penalty, pure)
+        profitsBuyer, profitsSeller = calculateProfitsSparse(
+            winners, marketPrices, winningBids, N, penalty)
+        biddingFactor = updateBiddingFactorSparse(
+            biddingFactor, buyers, winnerEntries, lowerDelta, higherDelta)
+
+        row = (auctionRound + 1) % len(rBuyerProfit)
+        rMarketprices[row] = marketPrices
+        rSellerProfit[row] = rSellerProfit[row - 1]+profitsSeller
+        rBuyerProfit[row] = rBuyerProfit[row - 1]+profitsBuyer
+        if stats is not None:
+            stats.update(auctionRound + 1, rBuyerProfit[row], rSellerProfit[row], marketPrices)
+    return simulationResult(rBuyerProfit, rSellerProfit, rMarketprices, extras, stats)
+
+
+def initParticipation(amountBuyers, amountSellers, degree, rng=None):
+    """Random sparse participation of buyers in sellers
+
+    Every buyer bids on the items of degree sellers drawn at random
+    (fewer when draws coincide). The participation is kept seller-major,
+    like a CSR matrix of sellers by buyers: the buyers bidding on the
+    item of seller k are buyers[indptr[k]:indptr[k+1]], in increasing
+    order.
+
+    Returns:
+    (indptr (sellers+1,), buyers (participations,))
+    """
+    if not 1 <= degree <= amountSellers:
+        raise ValueError(f'Degree must be between 1 and the amount of sellers, got {degree}')
+    rng = getRng(rng)
+    size = (amountBuyers, degree)
+    if rng is np.random:
+        sellers = np.random.randint(low=0, high=amountSellers, size=size)
+    else:
+        sellers = rng.integers(low=0, high=amountSellers, size=size)
+    # sorted (seller, buyer) keys, without duplicate draws
+    keys = np.sort(sellers.astype(np.int64) * amountBuyers + np.arange(amountBuyers)[:, None],
+                   axis=None)
+    keys = keys[np.append(True, keys[1:] != keys[:-1])]
+    sellers, buyers = np.divmod(keys, amountBuyers)
+    indptr = np.zeros(amountSellers + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sellers, minlength=amountSellers), out=indptr[1:])
+    return indptr, buyers.astype(np.int32 if amountBuyers <= np.iinfo(np.int32).max else np.int64)
+
+
+def clearRoundSparse(itemStartingprice, sellerIDs, indptr, buyers, biddingFactor, numBuyers,
+                     penalty=0.05, pure=False):
+    """Auction all items of one round of a sparse market, in the given order
+
+    The rules are those of clearRoundBatch, applied to the participants
+    of every seller only. An item only depends on the earlier items of
+    the round through its participants that already won: in impure
+    auctions they bid at least item + (marketPrice_j - winningBid_j) +
+    winningBid_j*penalty for their best previous win j, in pure ones
+    they stop bidding. So a window of items is cleared at once with
+    segment reductions over its participants, and its outcome is kept
+    up to the first item with a participant that won earlier in the
+    window; the rest is cleared again. The window grows while no item
+    depends on an earlier one, so sparse markets need few passes.
+
+    Parameters:
+    itemStartingprice -- itemprice per seller (sellers,)
+    sellerIDs -- the sellers in sale order (sellers,)
+    indptr, buyers -- participation, see initParticipation
+    biddingFactor -- bidding factor per participation (participations,)
+    numBuyers -- amount of buyers
+    penalty -- penalty factor, only used by impure auctions
+    pure -- Boolean if buyers stop bidding after a win
+
+    Returns:
+    (winners, marketPrices, winningBids, winnerEntries) arrays with one
+    entry per item in sale order; winners and winnerEntries (the index
+    of the winning participation) are -1 for unsold items
+    """
+    numSellers = len(sellerIDs)
+    itemPrices = np.asarray(itemStartingprice, dtype=float)[sellerIDs]
+    counts = np.diff(indptr)[sellerIDs]
+    starts = np.zeros(numSellers + 1, dtype=np.int64)
+    np.cumsum(counts, out=starts[1:])
+    # participations and bids in sale order
+    entries = np.repeat(indptr[sellerIDs] - starts[:-1], counts) + np.arange(starts[-1])
+    entryBuyers = buyers[entries]
+    entryBids = biddingFactor[entries] * np.repeat(itemPrices, counts)
+
+    winners = np.full(numSellers, -1, dtype=np.intp)
+    winnerEntries = np.full(numSellers, -1, dtype=np.intp)
+    marketPrices = itemPrices.copy()
+    winningBids = np.zeros(numSellers)
+    bestLoss = np.full(numBuyers, -np.inf)
+    bidding = np.ones(numBuyers, dtype=bool)
+    firstWin = np.full(numBuyers, numSellers, dtype=np.intp)
+    start, window = 0, 64
+    while start < numSellers:
+        stop = min(start + window, numSellers)
+        # the window's items with participants, and their segments
+        positions = start + np.flatnonzero(counts[start:stop])
+        lo, hi = starts[start], starts[stop]
+        if not len(positions):
+            start, window = stop, 2 * window
+            continue
+        items = np.arange(len(positions))
+        item = np.repeat(items, counts[positions])
+        segments = starts[positions] - lo
+        entryBuyer = entryBuyers[lo:hi]
+        bids = entryBids[lo:hi]
+        if pure:
+            active = bidding[entryBuyer]
+        else:
+            active = np.ones(hi - lo, dtype=bool)
+            bids = np.maximum(bids, itemPrices[positions][item] + bestLoss[entryBuyer])
+        numActive = np.bincount(item, weights=active, minlength=len(items))
+        sold = numActive > 0
+        marketPrice = np.bincount(item, weights=np.where(active, bids, 0), minlength=len(items))
+        marketPrice = marketPrice / np.where(sold, numActive, 1)
+        eligible = active & (bids < marketPrice[item])
+        numEligible = np.bincount(item, weights=eligible, minlength=len(items))
+        stuck = sold & (numEligible == 0)
+        if np.any(stuck):
+            # all bids equal (e.g. an item priced 0): the lowest bids compete
+            lowest = np.minimum.reduceat(np.where(active, bids, np.inf), segments)
+            eligible |= stuck[item] & active & (bids <= lowest[item])
+            numEligible = np.bincount(item, weights=eligible, minlength=len(items))
+        candidates = np.where(eligible, bids, -np.inf)
+        best = np.maximum.reduceat(candidates, segments)
+        # first, so lowest buyer, of the highest eligible bids
+        winner = np.minimum.reduceat(
+            np.where(eligible & (candidates == best[item]), np.arange(hi - lo), hi - lo), segments)
+        soldItems, winner = items[sold], winner[sold]
+        candidates[winner] = -np.inf
+        secondBids = np.maximum.reduceat(candidates, segments)
+
+        # keep the items before the first one that depends on a win in the window
+        np.minimum.at(firstWin, entryBuyer[winner], soldItems)
+        dependent = firstWin[entryBuyer] < item
+        firstWin[entryBuyer[winner]] = numSellers
+        if np.any(dependent):
+            keep = np.min(item[dependent])
+            kept = soldItems < keep
+            soldItems, winner = soldItems[kept], winner[kept]
+            start, window = positions[keep], max(2 * (positions[keep] - start), 16)
         else:
-            winners, profitsBuyer, profitsSeller, marketPrices, overBidsRounds = auctionItemsStratTwo(auctionItemOrder,
-                                                                                                      biddingFactorOrder)
-            biddingFactor = updateBiddingFactorStratTwo(
-                biddingFactor, winners, auctionItemOrderInd, lowerDelta, higherDelta, overBidsRounds)
+            start, window = stop, 2 * window
+        sales = positions[soldItems]
+        winners[sales] = entryBuyer[winner]
+        winnerEntries[sales] = entries[lo + winner]
+        marketPrices[sales] = marketPrice[soldItems]
+        winningBids[sales] = np.where(numEligible[soldItems] > 1, secondBids[soldItems],
+                                      itemPrices[sales])
+        if pure:
+            bidding[winners[sales]] = False
+        else:
+            np.maximum.at(bestLoss, winners[sales],
+                          (marketPrices[sales] - winningBids[sales]) + winningBids[sales]*penalty)
+    return winners, marketPrices, winningBids, winnerEntries
 
-        rMarketprices.append(marketPrices)
-        rSellerProfit.append(rSellerProfit[-1]+profitsSeller)
-        rBuyerProfit.append(rBuyerProfit[-1]+profitsBuyer)
 
-        biddingFactorHistory.append(biddingFactor)
-    return rBuyerProfit, rSellerProfit, rMarketprices
+def calculateProfitsSparse(winners, marketPrices, winningBids, numBuyers, penalty):
+    """Settle one round of a sparse market
 
+    As calculateProfitsBatch, for one market with unsold items (winner
+    -1), without a loop over the sellers: the wins are grouped by buyer
+    in sale order, every win followed by another of the same buyer is
+    sold back and the last one is kept.
 
-def auctionItemsStratOne(itemStartingprice, biddingFactorAlpha, penalty=0.05):
-    """Aution round for strategy 1"""
-    auctionRounds = []
-    bids = biddingFactorAlpha * itemStartingprice
-    winners = []
-    for i, item in enumerate(itemStartingprice):
-        for winnerInd, marketPrice, winningBid in auctionRounds:
-            bids[winnerInd, i] = bids[winnerInd, i] - \
-                (marketPrice - winningBid) - winningBid*penalty
-        marketPrice = computeMarketPrice(bids, i)
-        sortedBids = sorted(bids[:, i][bids[:, i] < marketPrice])
-        winner = sortedBids[-1]
-        winnerInd = np.where(bids[:, i] == winner)[0][0]
-        winners.append(winnerInd)
-
-        if len(sortedBids) > 1:
-            winnerToPay = sortedBids[-2]
-        else:
-            winnerToPay = item
+    Returns:
+    (profitBuyer (buyers,), profitSeller (sellers,))
+    """
+    profitBuyer = np.zeros(numBuyers)
+    profitSeller = np.where(winners >= 0, winningBids, 0.0)
+    sold = np.flatnonzero(winners >= 0)
+    wins = sold[np.argsort(winners[sold], kind='stable')]
+    buyer = winners[wins]
+    resold = buyer[:-1] == buyer[1:]
+    resoldWins = wins[:-1][resold]
+    fee = np.zeros(len(wins))
+    fee[1:][resold] = winningBids[resoldWins]*penalty
+    profitSeller[resoldWins] += fee[1:][resold] - winningBids[resoldWins]
+    kept = np.append(~resold, True) if len(wins) else np.zeros(0, dtype=bool)
+    profitBuyer[buyer[kept]] = marketPrices[wins[kept]] - winningBids[wins[kept]] - fee[kept]
+    return profitBuyer, profitSeller
 
-        auctionRounds.append([winnerInd, marketPrice, winnerToPay])
 
-    profitBuyer, profitSeller = calculateProfits(auctionRounds, len(
-        biddingFactorAlpha), len(biddingFactorAlpha[1]), penalty)
+def updateBiddingFactorSparse(biddingFactor, buyers, winnerEntries, lowerDelta, higherDelta):
+    """Update the bidding factors of a sparse market in place
 
-    return winners, profitBuyer, profitSeller, np.array(auctionRounds)[:, 1]
+    The winning participation of every sold item is multiplied by the
+    lowerDelta of its buyer, every other participation by the
+    higherDelta of its buyer, as updateBiddingFactorBatch.
 
+    Parameters:
+    biddingFactor -- bidding factor per participation (participations,)
+    buyers -- buyer per participation, see initParticipation
+    winnerEntries -- winning participation per item, -1 if unsold
+    lowerDelta -- bid decrease factor per buyer (buyers,)
+    higherDelta -- bid increase factor per buyer (buyers,)
 
-def auctionItemsStratTwo(itemStartingprice, biddingFactorAlpha, penalty=0.05):
-    """Auction round for strategy 2"""
-    auctionRounds = []
-    overBidsRounds = []
-    bids = biddingFactorAlpha * itemStartingprice
-    winners = []
-    for i, item in enumerate(itemStartingprice):
-        for winnerInd, marketPrice, winningBid in auctionRounds:
-            bids[winnerInd, i] = bids[winnerInd, i] - \
-                (marketPrice - winningBid) - winningBid*penalty
-        marketPrice = computeMarketPrice(bids, i)
-        sortedBids = sorted(bids[:, i][bids[:, i] < marketPrice])
-        overBids = [j for j, bid in enumerate(bids[i]) if bid >= marketPrice]
-        overBidsRounds.append(overBids)
-        winner = sortedBids[-1]
-        winnerInd = np.where(bids[:, i] == winner)[0][0]
-        winners.append(winnerInd)
-
-        if len(sortedBids) > 1:
-            winnerToPay = sortedBids[-2]
-        else:
-            winnerToPay = item
+    Returns:
+    biddingFactor
+    """
+    won = winnerEntries[winnerEntries >= 0]
+    wonFactors = biddingFactor[won]
+    biddingFactor *= higherDelta[buyers]
+    biddingFactor[won] = wonFactors * lowerDelta[buyers[won]]
+    return biddingFactor
 
-        auctionRounds.append([winnerInd, marketPrice, winnerToPay])
 
-    profitBuyer, profitSeller = calculateProfits(auctionRounds, len(
-        biddingFactorAlpha), len(biddingFactorAlpha[1]), penalty)
+#####################
+# ONLINE STATISTICS #
+#####################
 
-    return winners, profitBuyer, profitSeller, np.array(auctionRounds)[:, 1], overBidsRounds
+class RunningMoments:
+    """Streaming count, mean, variance, minimum and maximum
 
+    Batches are folded in with the parallel Welford (Chan et al.)
+    update, so accumulators of different replicas or processes can be
+    merged without keeping their values.
+    """
 
-def updateBiddingFactorStratTwo(biddingFactor, winnerIDs, sellerIDs, lowerDelta, higherDelta, overBidsRounds):
-    """Bidding factor update for strategy 2"""
-    for winner, seller in enumerate(sellerIDs):
-        nonWinners = [i for i in range(
-            len(biddingFactor)) if i != winnerIDs[winner]]
-        biddingFactor[winnerIDs[winner],
-                      seller] *= lowerDelta[winnerIDs[winner]]
-        biddingFactor[nonWinners, seller] *= higherDelta[nonWinners]
-        for nw in nonWinners:
-            if nw in overBidsRounds[seller]:
-                biddingFactor[nw, seller] = np.random.uniform(
-                    low=1.0, high=biddingFactor[nw, seller])
-    print(biddingFactor)
-    return biddingFactor
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if len(values):
+            mean = np.mean(values)
+            self._combine(len(values), mean, np.sum((values - mean)**2),
+                          np.min(values), np.max(values))
+        return self
+
+    def merge(self, other):
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        return self
+
+    def _combine(self, count, mean, m2, low, high):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta**2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class QuantileSketch:
+    """Streaming quantiles in bounded memory, t-digest style
+
+    Values are buffered and merged into at most about compression/2
+    weighted centroids. Centroids are small in the tails and larger
+    around the median (arcsine scale function), so tail quantiles stay
+    accurate: the default compression is within about 0.5% of the exact
+    0.1% and 99.9% quantiles of a million lognormal values. Sketches
+    merge by adding each other's centroids.
+    """
+
+    def __init__(self, compression=500):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._buffer = []
+        self._buffered = 0
+
+    def add(self, values, weights=None):
+        values = np.asarray(values, dtype=float).ravel()
+        if not len(values):
+            return self
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=float).ravel()
+        self._buffer.append((values, weights))
+        self._buffered += len(values)
+        self.count += np.sum(weights)
+        self.min = min(self.min, np.min(values))
+        self.max = max(self.max, np.max(values))
+        if self._buffered > 10 * self.compression:
+            self._compress()
+        return self
+
+    def merge(self, other):
+        other._compress()
+        low, high = other.min, other.max
+        self.add(other.means, other.weights)
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+        return self
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        means = np.concatenate([self.means] + [v for v, _ in self._buffer])
+        weights = np.concatenate([self.weights] + [w for _, w in self._buffer])
+        self._buffer = []
+        self._buffered = 0
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        # bin the centroids by the quantile of their center
+        center = (np.cumsum(weights) - weights / 2) / np.sum(weights)
+        scale = self.compression / (2*np.pi) * (np.arcsin(2*center - 1) + np.pi / 2)
+        bins = np.floor(scale).astype(np.intp)
+        self.weights = np.bincount(bins, weights)
+        kept = self.weights > 0
+        self.means = (np.bincount(bins, weights * means)[kept] / self.weights[kept])
+        self.weights = self.weights[kept]
+
+    def quantile(self, q):
+        """Estimated q-quantile(s), q in [0, 1]"""
+        self._compress()
+        if not self.count:
+            return np.full(np.shape(q), np.nan)[()]
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return np.interp(np.asarray(q) * self.count, np.concatenate([[0], centers, [self.count]]),
+                         np.concatenate([[self.min], self.means, [self.max]]))
+
+
+class SimulationStats:
+    """Streaming summary of auction simulations, without their histories
+
+    Fed by the simulation functions with stats=..., round by round, for
+    one or many replicas. Keeps per round the mean and median over the
+    buyers, sellers and items (averaged over replicas, see
+    roundAggregates), RunningMoments and QuantileSketch of the final
+    buyer and seller profits and of all market prices. Memory is O(R)
+    for the round aggregates plus the bounded sketches, independent of
+    N, K and the number of replicas. One instance can be passed to many
+    runs, or instances merged, to aggregate across replicas.
+    """
+
+    SERIES = ['buyerProfit', 'sellerProfit', 'marketPrice']
+
+    def __init__(self, R, compression=500):
+        self.rounds = R
+        self.replicas = 0
+        self._roundSums = {(s, a): np.zeros(R + 1) for s in self.SERIES for a in ('mean', 'median')}
+        self._roundCounts = np.zeros(R + 1)
+        self.moments = {s: RunningMoments() for s in self.SERIES}
+        self.sketches = {s: QuantileSketch(compression) for s in self.SERIES}
+
+    def update(self, auctionRound, buyerProfit, sellerProfit, marketPrices):
+        """Add one round, arrays (N,)/(K,) or (replicas, N)/(replicas, K)"""
+        series = dict(zip(self.SERIES, (np.atleast_2d(buyerProfit), np.atleast_2d(sellerProfit),
+                                        np.atleast_2d(marketPrices))))
+        for name, values in series.items():
+            self._roundSums[name, 'mean'][auctionRound] += np.sum(np.mean(values, axis=-1))
+            self._roundSums[name, 'median'][auctionRound] += np.sum(np.median(values, axis=-1))
+        self._roundCounts[auctionRound] += len(series['buyerProfit'])
+        if auctionRound:
+            self.moments['marketPrice'].add(series['marketPrice'])
+            self.sketches['marketPrice'].add(series['marketPrice'])
+        if auctionRound == self.rounds:
+            self.replicas += len(series['buyerProfit'])
+            for name in ('buyerProfit', 'sellerProfit'):
+                self.moments[name].add(series[name])
+                self.sketches[name].add(series[name])
+
+    def merge(self, other):
+        """Fold in the statistics of other runs with the same R"""
+        for key, sums in other._roundSums.items():
+            self._roundSums[key] += sums
+        self._roundCounts += other._roundCounts
+        self.replicas += other.replicas
+        for name in self.SERIES:
+            self.moments[name].merge(other.moments[name])
+            self.sketches[name].merge(other.sketches[name])
+        return self
+
+    def roundAggregates(self):
+        """{(series, 'mean'|'median'): per round value, (R+1,)}, what visualize plots"""
+        counts = np.maximum(self._roundCounts, 1)
+        return {key: sums / counts for key, sums in self._roundSums.items()}
+
+    def summary(self, quantiles=(0.25, 0.5, 0.75)):
+        """Flat dict of count, mean, std, min, max and quantiles per series
+
+        Profits are the final ones of every buyer/seller of every
+        replica, market prices those of all items of all rounds.
+        """
+        result = {'replicas': self.replicas}
+        for name in self.SERIES:
+            moments = self.moments[name]
+            result.update({f'{name}Mean': moments.mean, f'{name}Std': moments.std,
+                           f'{name}Min': moments.min, f'{name}Max': moments.max})
+            for q, value in zip(quantiles, self.sketches[name].quantile(quantiles)):
+                result[f'{name}Q{round(q*100):02d}'] = value
+        return result
+
+
+###################
+# PARAMETER SWEEP #
+###################
+
+SWEEP_PARAMETERS = ['M', 'K', 'N', 'R', 'Smax', 'penalty', 'pure', 'strategy']
+SWEEP_DEFAULTS = {'M': numItems, 'K': numSellers, 'N': numBuyers, 'R': numRounds,
+                  'Smax': maxStartingPrice, 'penalty': penalty, 'pure': pure,
+                  'strategy': 'standard'}
+SWEEP_STATISTICS = ['buyerProfitMean', 'buyerProfitMedian', 'sellerProfitMean',
+                    'sellerProfitMedian', 'marketPriceMean', 'marketPriceFinal']
+
+
+def sweepConfigurations(grid):
+    """All valid configurations of a grid
+
+    grid maps parameters of SWEEP_PARAMETERS to lists of values, or is a
+    list of configurations, dicts of parameters to single values, for
+    grids whose parameters depend on each other (e.g. M = K). Parameters
+    not given keep SWEEP_DEFAULTS. Configurations without more buyers
+    than sellers are skipped, as are pure ones for the alternative
+    strategies (they only exist as impure auctions).
+    """
+    if isinstance(grid, dict):
+        unknown = set(grid)
+        values = [grid.get(p, [SWEEP_DEFAULTS[p]]) for p in SWEEP_PARAMETERS]
+        configs = (dict(zip(SWEEP_PARAMETERS, c)) for c in itertools.product(*values))
+    else:
+        grid = list(grid)
+        unknown = set().union(*grid)
+        configs = (dict(SWEEP_DEFAULTS, **config) for config in grid)
+    unknown -= set(SWEEP_PARAMETERS)
+    if unknown:
+        raise ValueError(f'Unknown sweep parameters: {sorted(unknown)}')
+    for config in configs:
+        if config['strategy'] not in BUYER_STRATEGIES:
+            raise ValueError(f'Unknown strategy: {config["strategy"]}')
+        if config['N'] <= config['K'] or (config['pure'] and config['strategy'] != 'standard'):
+            continue
+        yield config
+
+
+def _sweepKey(config):
+    return tuple(str(config[p]) for p in SWEEP_PARAMETERS)
+
+
+def _sweepPoint(task):
+    """Simulate the replicas of one configuration and summarize them"""
+    config, replicas, seed = task
+    # every configuration has its own stream, whatever the grid or the worker
+    stream = np.random.SeedSequence([seed, zlib.crc32(repr(_sweepKey(config)).encode())])
+    M, K, N, R, Smax = (config[p] for p in ['M', 'K', 'N', 'R', 'Smax'])
+    stats = SimulationStats(R)
+    auctionSimulationBatch(M, K, N, R, Smax, replicas, config['penalty'], config['pure'],
+                           np.random.default_rng(stream), stats=stats, strategies=config['strategy'])
+    summary = stats.summary((0.5,))
+    row = dict(config, replicas=replicas, seed=seed)
+    row.update(buyerProfitMean=summary['buyerProfitMean'],
+               buyerProfitMedian=summary['buyerProfitQ50'],
+               sellerProfitMean=summary['sellerProfitMean'],
+               sellerProfitMedian=summary['sellerProfitQ50'],
+               marketPriceMean=summary['marketPriceMean'],
+               marketPriceFinal=stats.roundAggregates()['marketPrice', 'mean'][-1])
+    return row
+
+
+def sweep(grid, replicas=100, results='sweep.csv', workers=None, seed=0):
+    """Run a grid of auction configurations and collect a results table
+
+    Every configuration (see sweepConfigurations) is simulated replicas
+    times and summarized by SWEEP_STATISTICS over the final profits of
+    all buyers/sellers of all replicas and the market prices, streamed
+    through SimulationStats (medians are sketch estimates). Each
+    configuration seeds its own random stream from seed and its
+    parameters, so results do not depend on the number of workers.
+
+    Parameters:
+    grid -- {parameter: list of values} or a list of configurations, see
+            sweepConfigurations
+    replicas -- simulations per configuration
+    results -- CSV file; a row is appended as soon as a configuration
+               finishes and configurations already in it with the same
+               replicas and seed are skipped, so a killed sweep resumes
+               where it stopped
+    workers -- processes (None for one per core, 1 runs in process)
+    seed -- base seed of the sweep
+
+    Returns:
+    List of result rows (dicts) of this call
+    """
+    columns = SWEEP_PARAMETERS + ['replicas', 'seed'] + SWEEP_STATISTICS
+    done = set()
+    header = not os.path.exists(results) or os.path.getsize(results) == 0
+    if not header:
+        with open(results, newline='') as file:
+            reader = csv.DictReader(file)
+            if reader.fieldnames != columns:
+                raise ValueError(f'{results} has other columns than a sweep results table')
+            done = {tuple(row[p] for p in SWEEP_PARAMETERS + ['replicas', 'seed'])
+                    for row in reader}
+    tasks = [(config, replicas, seed) for config in sweepConfigurations(grid)
+             if _sweepKey(config) + (str(replicas), str(seed)) not in done]
+    rows = []
+    with open(results, 'a', newline='') as file:
+        writer = csv.DictWriter(file, columns)
+        if header:
+            writer.writeheader()
+
+        def write(row):
+            writer.writerow(row)
+            file.flush()
+            rows.append(row)
+
+        if workers == 1:
+            for task in tasks:
+                write(_sweepPoint(task))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for future in as_completed([executor.submit(_sweepPoint, t) for t in tasks]):
+                    write(future.result())
+    return rows
 
 
 ####################
 # HELPER FUNCTIONS #
 ####################
 
-def assignItemToSeller(S, M):
+def recordTypes(extras, auctionRound, seller2Items, itemTypes, marketPrices, winningBids,
+                sellerProfit):
+    """Store the per-type aggregates of a round, see historyBuffers
+
+    Parameters:
+    seller2Items -- item type per seller (..., K)
+    itemTypes -- item type per position in the sale order (..., K)
+    marketPrices -- market price per position in the sale order (..., K)
+    winningBids -- price paid per position in the sale order (..., K)
+    sellerProfit -- profit so far per seller (..., K)
+    """
+    numTypes = extras['typeMarketPrices'].shape[-1]
+    with np.errstate(invalid='ignore'):
+        counts, sums = typeAggregates(itemTypes, marketPrices, numTypes)
+        extras['typeMarketPrices'][..., auctionRound, :] = sums / counts
+        counts, sums = typeAggregates(itemTypes, winningBids, numTypes)
+        extras['typeWinningBids'][..., auctionRound, :] = sums / counts
+        counts, sums = typeAggregates(seller2Items, sellerProfit, numTypes)
+        extras['typeSellerProfits'][..., auctionRound, :] = sums / counts
+
+
+def typeAggregates(itemTypes, values, numTypes=None):
+    """Count and sum of values per item type, in one np.bincount
+
+    Parameters:
+    itemTypes -- item type per seller (..., K)
+    values -- value per seller (..., K), e.g. prices or profits
+    numTypes -- amount of item types M, by default the largest type + 1
+
+    Returns:
+    (counts, sums) shaped (..., M)
+    """
+    values = np.asarray(values, dtype=float)
+    itemTypes = np.broadcast_to(itemTypes, values.shape)
+    if numTypes is None:
+        numTypes = int(np.max(itemTypes)) + 1
+    lead = values.shape[:-1]
+    groups = int(np.prod(lead))
+    # one block of numTypes bins per leading index
+    index = (np.arange(groups).reshape(lead + (1,)) * numTypes + itemTypes).ravel()
+    counts = np.bincount(index, minlength=groups * numTypes).reshape(lead + (numTypes,))
+    sums = np.bincount(index, values.ravel(), minlength=groups * numTypes).reshape(lead + (numTypes,))
+    return counts, sums
+
+
+def getRng(rng=None):
+    """Random generator for a seed, SeedSequence or Generator
+
+    None gives the global np.random state, so np.random.seed still
+    reproduces runs that do not pass a generator.
+    """
+    if rng is None or rng is np.random:
+        return np.random
+    return np.random.default_rng(rng)
+
+
+def historyBuffers(K, N, R, B=None, historyDir=None, factorStride=None, ring=False, M=None):
+    """Preallocated, zeroed histories of a simulation
+
+    Profits and market prices get one row per round plus the starting
+    row, (R+1, N) and (R+1, K), or (B, R+1, ...) for B replicas. With a
+    historyDir they are memory-mapped .npy files in it (buyerProfit,
+    sellerProfit, marketPrices, biddingFactors) so long runs need
+    bounded memory and leave their results on disk.
+
+    With factorStride the extras dict holds 'biddingFactors', copies of
+    the factors at the rounds in 'biddingFactorRounds' (0, factorStride,
+    ...), shaped (snapshots, N, K) or (B, snapshots, N, K). Otherwise
+    extras is None.
+
+    With M (typeMarket runs) the extras hold per item type and round,
+    (R+1, M) or (B, R+1, M): 'typeMarketPrices' and 'typeWinningBids',
+    the mean market price and mean price paid by the winners for the
+    items of the type sold that round (nan if none), and
+    'typeSellerProfits', the mean profit so far of its sellers. See
+    recordTypes.
+
+    With ring the profits and market prices only keep two rows, the
+    current round at (round % 2) and the one before, for statistics-only
+    runs.
+
+    Returns:
+    (buyerProfit, sellerProfit, marketPrices, extras)
+    """
+    if historyDir is not None:
+        os.makedirs(historyDir, exist_ok=True)
+
+    def allocate(name, shape):
+        if B is not None:
+            shape = (B,) + shape
+        if historyDir is None:
+            return np.zeros(shape)
+        return np.lib.format.open_memmap(os.path.join(historyDir, name + '.npy'),
+                                         mode='w+', dtype=float, shape=shape)
+
+    extras = None
+    if factorStride or M:
+        extras = {}
+    if factorStride:
+        rounds = np.arange(0, R + 1, factorStride)
+        extras.update(biddingFactorRounds=rounds, factorStride=factorStride,
+                      biddingFactors=allocate('biddingFactors', (len(rounds), N, K)))
+    if M:
+        extras.update(typeMarketPrices=allocate('typeMarketPrices', (R + 1, M)),
+                      typeWinningBids=allocate('typeWinningBids', (R + 1, M)),
+                      typeSellerProfits=allocate('typeSellerProfits', (R + 1, M)))
+    rows = 2 if ring else R + 1
+    return (allocate('buyerProfit', (rows, N)), allocate('sellerProfit', (rows, K)),
+            allocate('marketPrices', (rows, K)), extras)
+
+
+def simulationResult(rBuyerProfit, rSellerProfit, rMarketprices, extras, stats):
+    """Return value of the simulation functions, see historyBuffers"""
+    result = (rBuyerProfit, rSellerProfit, rMarketprices) if stats is None else (stats,)
+    if extras is not None:
+        result += (extras,)
+    return result if len(result) > 1 else result[0]
+
+
+def recordFactors(extras, auctionRound, biddingFactor):
+    """Copy the bidding factors into the history if the round is due"""
+    if extras is not None and 'factorStride' in extras and auctionRound % extras['factorStride'] == 0:
+        snapshot = auctionRound // extras['factorStride']
+        if biddingFactor.ndim == 3:
+            extras['biddingFactors'][:, snapshot] = biddingFactor
+        else:
+            extras['biddingFactors'][snapshot] = biddingFactor
+
+
+def assignItemToSeller(S, M, rng=None):
     """Every seller gets assigned a random itemtype
 
     There are M types of items to be auctioned. In the beginning of
@@ -380,7 +1462,10 @@ def assignItemToSeller(S, M):
     the item m element of M, which it will auction across all the rounds.
     Note that multiple sellers might sell item m of the same type.
     """
-    return np.random.randint(low=0, high=M, size=S)
+    rng = getRng(rng)
+    if rng is np.random:
+        return np.random.randint(low=0, high=M, size=S)
+    return rng.integers(low=0, high=M, size=S)
 
 
 def computeMarketPrice(bids, i):
@@ -396,22 +1481,25 @@ def computeMarketPrice(bids, i):
     return np.mean(bids[:, i])
 
 
-def initBiddingFactor(amountBuyers, amountSellers):
+def initBiddingFactor(amountBuyers, amountSellers, amountReplicas=None, rng=None):
     """Generate initial bidding factor
 
     The initial bidding factor is not generated for every round
     because it persists between rounds. The updateBiddingFactor
-    function handles the updating.
+    function handles the updating. With amountReplicas one factor
+    matrix per replica is stacked in front.
     """
-    # biddingfactor is 2 dimensional
-    biddingFactorAlpha = np.random.uniform(low=1.0, high=1.9,
-                                           size=(amountBuyers, amountSellers))
+    # biddingfactor is 2 dimensional, or 3 with replicas
+    size = (amountBuyers, amountSellers)
+    if amountReplicas is not None:
+        size = (amountReplicas,) + size
+    biddingFactorAlpha = getRng(rng).uniform(low=1.0, high=1.9, size=size)
     return biddingFactorAlpha
 
 
-def assignPriceToItem(sellerItems, numRounds, maxPrice):
+def assignPriceToItem(sellerItems, numRounds, maxPrice, rng=None):
     """Every seller assigns a price to its item"""
-    itemPrices = np.random.uniform(
+    itemPrices = getRng(rng).uniform(
         size=(numRounds, len(sellerItems)), low=0, high=maxPrice)
     return np.round(itemPrices, decimals=2)
 
@@ -523,26 +1611,15 @@ def main():
 
 
 def experiment():
-    buyerincrease = 10
-    sellerincrease = 10
+    """Sweep the market sizes and penalties of the impure auction, see sweep"""
     step = 5
-
-    penalty_start = 0
-    penalty_step = 0.01
-    penalty_max = 1
-    pure = False
-    # for ns in range(1, sellerincrease):
-    #    for nb in range(ns+1, ns+buyerincrease):
-    #        b, s, m = auctionSimulation(
-    #            ns*step, ns*step, nb*step, 20, 100, pure=pure)
-    #        visualize(nb*step, ns*step, b, s, m, pure, save=True)
-    current_penalty = penalty_start
-    # while current_penalty <= penalty_max:
-    #    print('penalty ', current_penalty)
-    #    b, s, m = auctionSimulation(
-    #       5, 5, 20, 20, 100, pure=pure, penalty=current_penalty)
-    #    visualize(20, 5, b, s, m, pure, pen=current_penalty, save=True)
-    #    current_penalty += penalty_step
+    # as many item types as sellers, 5 to 45 more buyers than sellers
+    sweep([{'M': ns*step, 'K': ns*step, 'N': nb*step}
+           for ns in range(1, 10) for nb in range(ns+1, ns+10)],
+          results='sweep_sizes.csv')
+    sweep({'M': [5], 'K': [5], 'N': [20],
+           'penalty': list(np.round(np.arange(0, 1.01, 0.01), 2))},
+          results='sweep_penalty.csv')
 
 
 if __name__ == '__main__':
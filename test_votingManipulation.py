@@ -0,0 +1,68 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import votingManipulation as vm
+
+
+def bruteForceCoalitions(prefs, scheme):
+    """Minimal coalition sizes over every subset of supporters and joint ballot"""
+    amountOptions = prefs.shape[1]
+    weights = vm.schemeWeights(scheme, amountOptions)
+    ranks = vm.rankMatrix(prefs)
+    contrib = weights[ranks]
+    scores = contrib.sum(axis=0)
+    winner = np.argmax(scores)
+    ballots = np.unique(weights[vm.rankMatrix(vm.ballotTypes(amountOptions))], axis=0)
+    # points every multiset of k joint ballots can hand out
+    jointPoints = {0: np.zeros((1, amountOptions), dtype=np.int64)}
+    sizes = np.full(amountOptions, -1)
+    sizes[winner] = 0
+    for target in range(amountOptions):
+        if target == winner:
+            continue
+        supporters = np.flatnonzero(ranks[:, target] < ranks[:, winner])
+        for k in range(1, len(supporters) + 1):
+            if k not in jointPoints:
+                jointPoints[k] = np.unique((jointPoints[k - 1][:, None] + ballots[None])
+                                           .reshape(-1, amountOptions), axis=0)
+            if any(np.any(np.argmax(scores - contrib[list(members)].sum(axis=0) + jointPoints[k],
+                                    axis=1) == target)
+                   for members in itertools.combinations(supporters, k)):
+                sizes[target] = k
+                break
+    return sizes
+
+
+@pytest.mark.parametrize('scheme', ['VfO', 'VfT', 'Veto', 'Borda'])
+def test_minimalCoalitions_matches_brute_force(scheme):
+    rng = np.random.default_rng(0)
+    for _ in range(150):
+        amountVoters, amountOptions = rng.integers(3, 7), rng.integers(3, 5)
+        prefs = np.argsort(rng.random((amountVoters, amountOptions)), axis=1)
+        expected = bruteForceCoalitions(prefs, scheme)
+        assert np.array_equal(vm.minimalCoalitions(prefs, scheme, exact=True), expected)
+        # without exact the sizes are upper bounds
+        sizes = vm.minimalCoalitions(prefs, scheme)
+        found = sizes != -1
+        assert np.all(expected[found] != -1) and np.all(sizes[found] >= expected[found])
+
+
+def test_minimalCoalitions_chooses_members():
+    # voter 1 alone can install D under Veto, voter 0 cannot
+    prefs, _ = vm.encodePrefs([list('DBAC'), list('DBCA'), list('DCBA')])
+    assert vm.minimalCoalitions(prefs, 'Veto')[3] == 1
+    assert vm.coalitionManipulation(vm.LETTERS[prefs], 'Veto')['D'][:2] == (1, [1])
+
+
+@pytest.mark.parametrize('text, line', [('ABC\nAB\n', 2), ('ABC\nABD\n', 2),
+                                        ('# header\nAAB\n', 2), ('AB\nBA\n\nABC\nCAB\nBC\n', 6)])
+def test_readProfiles_rejects_invalid_ballots(text, line):
+    with pytest.raises(ValueError, match=f'Line {line}:'):
+        list(vm.readProfiles(text.splitlines()))
+
+
+def test_readProfiles_separates_profiles():
+    profiles = list(vm.readProfiles('A, B C\nCBA\n\n# second\nBA\nAB\n'.splitlines()))
+    assert [p.tolist() for p in profiles] == [[list('ABC'), list('CBA')], [list('BA'), list('AB')]]
@@ -1,41 +1,167 @@
 import numpy as np
-from collections import Counter
 import itertools
-import copy
+import math
+import functools
+import collections
+import os
+import sys
 
-OUTPUT = ''
-strategic_distr = {}
+LETTERS = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+# name -> {'weights': points per position} or {'scores': kernel}, see registerScoringRule
+VOTING_RULES = {}
+# entries per outcome cache, see setOutcomeCacheSize; a sincere outcome
+# entry holds O(options) values, a strategic one the ballot classes
+OUTCOME_CACHE_SIZE = 4096
 
 
-def _risk_exp_helper(prefs, voting=['VfO']):
+def _risk_exp_helper(prefs, voting=['VfO'], weight=1, distr=None):
+    """Add the share of strategic voters of one profile to a histogram"""
+    if distr is None:
+        distr = {}
     prefMatrix = np.array(prefs)
     votingSchemes = voting
-    global strategic_distr
     # votingSchemes = ["VfT"]
     for scheme in votingSchemes:
-        winner = votingResults(prefMatrix, scheme)
-        happiness = calcHappiness(winner, prefMatrix)
         numLyingVoters = 0
         for i, voter in enumerate(prefMatrix):
             voterLies, sVotingOptions, winners, voterHappinesses, totalHappinesses = howShouldVoterLie(i, prefMatrix, scheme)
             if voterLies != 0:
                 numLyingVoters += 1
         strategic_voting_val = numLyingVoters/prefMatrix.shape[0]
-        if strategic_voting_val in strategic_distr.keys():
-            strategic_distr[strategic_voting_val] += 1
+        if strategic_voting_val in distr.keys():
+            distr[strategic_voting_val] += weight
         else:
-            strategic_distr[strategic_voting_val] = 1
+            distr[strategic_voting_val] = weight
+    return distr
+
+
+def _risk_chunk(task):
+    """Strategic-voting histogram of one chunk of the profile space"""
+    amount_voters, amount_options, start, stop, weighted, scheme = task
+    types = ballotTypes(amount_options)
+    distr = {}
+    for counts, weight in anonymousProfiles(amount_voters, amount_options, weighted,
+                                            start=start, stop=stop):
+        _risk_exp_helper(LETTERS[types.repeat(counts, axis=0)], scheme, weight, distr)
+    return distr
+
+
+def _happiness_chunk(task):
+    """Count of profiles per happiest scheme for one chunk of the profile space"""
+    amount_voters, amount_options, start, stop, weighted, schemes = task
+    types = ballotTypes(amount_options)
+    scheme_stats = {s: 0 for s in schemes}
+    profiles = list(anonymousProfiles(amount_voters, amount_options, weighted,
+                                      start=start, stop=stop))
+    if not profiles:
+        return scheme_stats
+    prefs = np.stack([types.repeat(counts, axis=0) for counts, _ in profiles])
+    happiness = schemeHappiness(prefs, schemes).sum(axis=-1)
+    # the last scheme reaching the maximum wins
+    best = len(schemes) - 1 - np.argmax(happiness[:, ::-1], axis=-1)
+    for (counts, weight), b in zip(profiles, best):
+        scheme_stats[schemes[b]] += weight
+    return scheme_stats
+
+
+def _merge_counts(total, part):
+    for key, count in part.items():
+        total[key] = total.get(key, 0) + count
+    return total
+
+
+def _run_sharded(chunkFunction, amount_voters, amount_options, args, workers=1, chunksize=500,
+                 start=0):
+    """Evaluate the profile space chunk by chunk, yielding partial results in order
+
+    Chunks are fixed rank ranges of anonymousProfiles starting at the
+    given rank, so the split does not depend on the number of workers.
+    With more than one worker the chunks run in a process pool, with a
+    bounded number in flight.
+    """
+    total = countProfiles(amount_voters, amount_options)
+    tasks = ((amount_voters, amount_options, begin, min(begin + chunksize, total)) + args
+             for begin in range(start, total, chunksize))
+    if workers == 1:
+        yield from map(chunkFunction, tasks)
+        return
+    # only worker pools pay for importing multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(executor.submit(chunkFunction, task))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _load_checkpoint(path, settings, counts):
+    """Partial counts and profile cursor saved by _save_checkpoint
+
+    Returns the given counts and cursor 0 if there is no checkpoint yet.
+    """
+    if not os.path.exists(path):
+        return counts, 0
+    with np.load(path) as checkpoint:
+        if str(checkpoint['settings']) != settings:
+            raise ValueError(f'Checkpoint {path} belongs to a different experiment')
+        counts = [int(c) for c in checkpoint['counts']]
+        return dict(zip(checkpoint['keys'].tolist(), counts)), int(checkpoint['cursor'])
 
 
-def risk_experiment(amount_voters, amount_options, scheme=['VfO']):
-    global strategic_distr
-    for m in generatePrefMatrix(amount_voters, amount_options):
-        _risk_exp_helper(m, scheme)
+def _save_checkpoint(path, settings, cursor, counts):
+    """Atomically write the profile cursor and the counts so far"""
+    # counts are stored as text since weighted counts outgrow int64
+    tmpPath = path + '.tmp.npz'
+    np.savez_compressed(tmpPath, settings=settings, cursor=cursor,
+                        keys=np.array(list(counts.keys())),
+                        counts=np.array([str(c) for c in counts.values()]))
+    os.replace(tmpPath, path)
+
+
+def _run_checkpointed(chunkFunction, amount_voters, amount_options, args, counts, workers,
+                      chunksize, checkpoint, checkpointEvery):
+    """Merge the chunk results into counts, resuming from and saving to checkpoint"""
+    cursor = 0
+    if checkpoint is not None:
+        settings = repr((amount_voters, amount_options) + args)
+        counts, cursor = _load_checkpoint(checkpoint, settings, counts)
+    total = countProfiles(amount_voters, amount_options)
+    chunks = _run_sharded(chunkFunction, amount_voters, amount_options, args, workers, chunksize,
+                          cursor)
+    for done, part in enumerate(chunks, 1):
+        _merge_counts(counts, part)
+        cursor = min(cursor + chunksize, total)
+        if checkpoint is not None and (done % checkpointEvery == 0 or cursor == total):
+            _save_checkpoint(checkpoint, settings, cursor, counts)
+    return counts
+
+
+def risk_experiment(amount_voters, amount_options, scheme=['VfO'], weighted=False, workers=1,
+                    chunksize=500, checkpoint=None, checkpointEvery=10):
+    """Distribution of the share of voters that can vote strategically
+
+    Every anonymous profile counts once, or with its multinomial weight
+    if weighted. The profile space is split into chunks of chunksize
+    profiles that are evaluated by workers processes (None for one per
+    core).
+
+    With a checkpoint file the profile cursor and the histogram so far
+    are saved every checkpointEvery chunks, and a rerun with the same
+    arguments resumes from there.
+    """
+    strategic_distr = _run_checkpointed(_risk_chunk, amount_voters, amount_options,
+                                        (weighted, list(scheme)), {}, workers,
+                                        chunksize, checkpoint, checkpointEvery)
     print('DISTRIBUTION', strategic_distr)
-    strategic_distr = {}
+    return strategic_distr
 
 
-def overall_happiness_experiment(amount_voters, amountoptions):
+def overall_happiness_experiment(amount_voters, amount_options, weighted=False, workers=1,
+                                 chunksize=500, checkpoint=None, checkpointEvery=10):
     # for every matrix
     # for every scheme
     # max{scheme}(happiness)
@@ -44,67 +170,693 @@ def overall_happiness_experiment(amount_voters, amountoptions):
     for s in schemes:
         scheme_stats[s] = 0
 
-    for m in generatePrefMatrix(amount_voters, amount_options):
-        m = np.array(m)
-        max_happiness = 0
-        for scheme in schemes:
-            winner = votingResults(m, scheme)
-            happiness = np.sum(calcHappiness(winner, m))
-            if happiness >= max_happiness:
-                max_happiness = happiness
-                winner_scheme = scheme
-        scheme_stats[winner_scheme] += 1
+    scheme_stats = _run_checkpointed(_happiness_chunk, amount_voters, amount_options,
+                                     (weighted, schemes), scheme_stats, workers,
+                                     chunksize, checkpoint, checkpointEvery)
+    print(scheme_stats)
+    return scheme_stats
+
+
+def _interval(successes, samples, confidence):
+    """Wilson score confidence half-width of a proportion"""
+    import statistics
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    p = successes / samples
+    return z / (1 + z**2 / samples) * np.sqrt(p * (1 - p) / samples + z**2 / (4 * samples**2))
+
+
+def risk_sampling_experiment(amount_voters, amount_options, scheme=['VfO'], culture='IC', phi=0.5,
+                             precision=0.01, confidence=0.95, batch=200, minSamples=1000,
+                             maxSamples=10**6, rng=None):
+    """Estimate the share of strategic voters from sampled profiles
+
+    Profiles are drawn in batches from a culture (see sampleProfiles)
+    until the confidence interval of the mean risk of every scheme is
+    narrower than +-precision (after at least minSamples profiles), or
+    maxSamples profiles were drawn.
+
+    Returns:
+    Per scheme a dict with the samples drawn, the mean risk and its
+    confidence half-width, and the distribution of the risk as
+    {risk: (share of profiles, confidence half-width)}.
+    """
+    import statistics
+    rng = np.random.default_rng(rng)
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    histograms = {s: np.zeros(amount_voters + 1, dtype=np.int64) for s in scheme}
+    samples = 0
+    while samples < maxSamples:
+        prefs = sampleProfiles(amount_voters, amount_options, min(batch, maxSamples - samples),
+                               culture, phi, rng)
+        samples += len(prefs)
+        for s in scheme:
+            lying = manipulableVoters(prefs, s).sum(axis=-1)
+            histograms[s] += np.bincount(lying, minlength=amount_voters + 1)
+        halfWidths = []
+        for s in scheme:
+            risks = np.arange(amount_voters + 1) / amount_voters
+            mean = histograms[s] @ risks / samples
+            var = histograms[s] @ (risks - mean) ** 2 / max(samples - 1, 1)
+            halfWidths.append(z * np.sqrt(var / samples))
+        if samples >= minSamples and max(halfWidths) <= precision:
+            break
+
+    results = {}
+    for s, halfWidth in zip(scheme, halfWidths):
+        risks = np.arange(amount_voters + 1) / amount_voters
+        distribution = {float(risks[k]): (float(histograms[s][k] / samples),
+                                          float(_interval(histograms[s][k], samples, confidence)))
+                        for k in np.flatnonzero(histograms[s])}
+        results[s] = {'samples': samples, 'mean': float(histograms[s] @ risks / samples),
+                      'halfWidth': float(halfWidth), 'distribution': distribution}
+        print(f'{s}: risk {results[s]["mean"]:.4f} +- {halfWidth:.4f} ({samples} profiles)')
+    return results
+
+
+def overall_happiness_sampling_experiment(amount_voters, amount_options, culture='IC', phi=0.5,
+                                          precision=0.01, confidence=0.95, batch=200,
+                                          minSamples=1000, maxSamples=10**6, rng=None):
+    """Estimate how often each scheme gives the highest overall happiness
+
+    Like overall_happiness_experiment on sampled profiles, stopping once
+    every share is known to +-precision.
+
+    Returns:
+    {scheme: (share of profiles, confidence half-width)}
+    """
+    rng = np.random.default_rng(rng)
+    schemes = ['VfO', 'VfT', 'Veto', 'Borda']
+    counts = np.zeros(len(schemes), dtype=np.int64)
+    samples = 0
+    while samples < maxSamples:
+        prefs = sampleProfiles(amount_voters, amount_options, min(batch, maxSamples - samples),
+                               culture, phi, rng)
+        samples += len(prefs)
+        happiness = schemeHappiness(prefs, schemes).sum(axis=-1)
+        # the last scheme reaching the maximum wins, as in the exhaustive version
+        best = len(schemes) - 1 - np.argmax(happiness[:, ::-1], axis=-1)
+        counts += np.bincount(best, minlength=len(schemes))
+        if samples >= minSamples and max(_interval(c, samples, confidence)
+                                         for c in counts) <= precision:
+            break
+    scheme_stats = {s: (float(c / samples), float(_interval(c, samples, confidence)))
+                    for s, c in zip(schemes, counts)}
     print(scheme_stats)
+    return scheme_stats
 
 
 def generatePrefMatrix(amount_voters, amount_options):
     full_options = [a for a in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ']
     current_options = full_options[:amount_options]
     perms = [list(i) for i in itertools.permutations(current_options)]
-    tuplematrix = [list(i) for i in itertools.combinations_with_replacement(perms, amount_voters)]
-    return tuplematrix
+    for i in itertools.combinations_with_replacement(perms, amount_voters):
+        yield list(i)
+
+
+def ballotTypes(amount_options):
+    """All m! ballots as candidate indices, in itertools.permutations order"""
+    return np.array(list(itertools.permutations(range(amount_options))))
+
+
+def _relabelledTypes(types):
+    """Ballot type each type becomes under every relabelling of the candidates
+
+    Row s maps type t to the type of the ballot types[s][types[t]].
+    """
+    amountOptions = types.shape[1]
+    # types are in lexicographical order, so a ballot's rank is its type
+    radix = np.array([math.factorial(amountOptions - 1 - j) for j in range(amountOptions)])
+    relabelled = types[:, types]
+    smaller = np.triu(relabelled[..., :, None] > relabelled[..., None, :], k=1).sum(axis=-1)
+    return smaller @ radix
+
+
+def countProfiles(amount_voters, amount_options):
+    """Number of anonymous profiles"""
+    return math.comb(math.factorial(amount_options) + amount_voters - 1, amount_voters)
+
+
+def _profileRange(amountTypes, amountVoters, start=0, stop=None):
+    """Sorted ballot types of the anonymous profiles ranked in [start, stop)
+
+    The ranks follow itertools.combinations_with_replacement, but the
+    first profile is computed directly instead of skipping to it.
+    """
+    if stop is None:
+        stop = math.comb(amountTypes + amountVoters - 1, amountVoters)
+    profile = np.empty(amountVoters, dtype=np.int64)
+    rank = start
+    low = 0
+    for i in range(amountVoters):
+        left = amountVoters - i - 1
+        for t in range(low, amountTypes):
+            completions = math.comb(amountTypes - t + left - 1, left)
+            if rank < completions:
+                break
+            rank -= completions
+        profile[i] = low = t
+    for _ in range(start, stop):
+        yield profile.copy()
+        # next profile: bump the last type that can grow, repeat it after
+        growable = np.flatnonzero(profile < amountTypes - 1)
+        if len(growable) == 0:
+            return
+        profile[growable[-1]:] = profile[growable[-1]] + 1
+
+
+def anonymousProfiles(amount_voters, amount_options, weighted=False, symmetric=False,
+                      start=0, stop=None):
+    """Lazily yield every anonymous profile with its weight
+
+    A profile is the count of voters casting each of the m! ballot types
+    (see ballotTypes), in the order of generatePrefMatrix.
+
+    Parameters:
+    weighted -- weigh each profile with the number of ordered profiles
+                (multinomial coefficient) it stands for, instead of 1
+    symmetric -- only yield profiles that are the smallest of their orbit
+                 under relabelling of the candidates, weighted by the size
+                 of the orbit. Only for statistics that do not change
+                 under relabelling: the voting schemes break ties by
+                 candidate index, which is not neutral, so the
+                 experiments enumerate every profile.
+    start, stop -- only the profiles ranked in [start, stop)
+
+    Yields:
+    (ballot counts, weight)
+    """
+    amountTypes = math.factorial(amount_options)
+    if symmetric:
+        relabelled = _relabelledTypes(ballotTypes(amount_options))
+    for profile in _profileRange(amountTypes, amount_voters, start, stop):
+        counts = np.bincount(profile, minlength=amountTypes)
+        weight = 1
+        if weighted:
+            weight = math.factorial(amount_voters)
+            for c in counts[counts > 1]:
+                weight //= math.factorial(c)
+        if symmetric:
+            orbit = np.sort(relabelled[:, profile], axis=1)
+            diff = orbit - profile
+            first = np.argmax(diff != 0, axis=1)
+            if np.any(diff[np.arange(len(diff)), first] < 0):
+                continue
+            weight *= len(orbit) // int(np.sum(~np.any(diff, axis=1)))
+        yield counts, weight
+
+
+def sampleProfiles(amount_voters, amount_options, size, culture='IC', phi=0.5, rng=None):
+    """Draw a batch of random profiles as integer preferences
+
+    Parameters:
+    culture -- 'IC' (impartial culture: every ballot independently
+               uniform), 'IAC' (impartial anonymous culture: every
+               anonymous profile equally likely) or 'Mallows' (ballots
+               around the order 0 < 1 < ... with dispersion phi)
+    phi -- Mallows dispersion, 0 is unanimity and 1 is impartial culture
+
+    Returns:
+    Array shaped (size, voters, options)
+    """
+    rng = np.random.default_rng(rng)
+    shape = (size, amount_voters, amount_options)
+    if culture == 'IC':
+        return np.argsort(rng.random(shape), axis=-1)
+    if culture == 'IAC':
+        # stars and bars: the voters are n of the n+m!-1 slots
+        amountTypes = math.factorial(amount_options)
+        slots = np.argsort(rng.random((size, amount_voters + amountTypes - 1)), axis=-1)
+        profiles = np.sort(slots[:, :amount_voters], axis=-1) - np.arange(amount_voters)
+        return ballotTypes(amount_options)[profiles]
+    if culture == 'Mallows':
+        # repeated insertion: candidate i goes j places above the bottom with prob ~ phi^j
+        prefs = np.zeros(shape, dtype=np.int64)
+        for i in range(1, amount_options):
+            p = phi ** np.arange(i + 1)
+            steps = rng.choice(i + 1, size=shape[:-1], p=p / p.sum())
+            slot = i - steps
+            index = np.arange(i + 1)
+            shifted = np.concatenate([prefs[..., :1], prefs[..., :i]], axis=-1)
+            prefs[..., :i + 1] = np.where(index < slot[..., None], prefs[..., :i + 1],
+                                          np.where(index == slot[..., None], i, shifted))
+        return prefs
+    raise ValueError(f'Unknown culture: {culture}')
 
 
 # calc the number of candidates - index where the first preference of voter is
-def calcHappiness(winner, prefMatrix):
-    return len(prefMatrix[0]) - np.where(prefMatrix == winner)[1] - 1
+def calcHappiness(winner, prefMatrix, ranks=None):
+    """Happiness of every voter with the winner
+
+    Pass the rankMatrix of the integer-encoded prefMatrix as ranks to
+    skip building it again.
+    """
+    intPrefs, candidates = encodePrefs(prefMatrix)
+    if ranks is None:
+        ranks = rankMatrix(intPrefs)
+    return happinessOf(ranks, np.searchsorted(candidates, winner))
+
+
+def rankMatrix(prefs):
+    """Position of every candidate on every ballot
+
+    Parameters:
+    prefs -- integer preferences, (voters, options) or
+             (profiles, voters, options)
+
+    Returns:
+    ranks with ranks[..., voter, candidate] = position, same shape as prefs
+    """
+    prefs = np.asarray(prefs)
+    ranks = np.empty_like(prefs)
+    np.put_along_axis(ranks, prefs, np.arange(prefs.shape[-1]), axis=-1)
+    return ranks
+
+
+def happinessOf(ranks, winners):
+    """Happiness of every voter with one winner per profile
+
+    Parameters:
+    ranks -- rankMatrix, (voters, options) or (profiles, voters, options)
+    winners -- winner index per profile, with optional extra trailing
+               axes (e.g. one winner per scheme)
+
+    Returns:
+    Happiness shaped winners.shape + (voters,)
+    """
+    winners = np.asarray(winners)
+    extra = winners.ndim - (ranks.ndim - 2)
+    ranks = ranks.reshape(ranks.shape[:-2] + (1,) * extra + ranks.shape[-2:])
+    chosen = np.take_along_axis(ranks, winners[..., None, None], axis=-1)[..., 0]
+    return ranks.shape[-1] - 1 - chosen
+
+
+def schemeHappiness(prefs, schemes, ranks=None):
+    """Happiness of every voter under every scheme
+
+    Returns:
+    Happiness shaped (..., schemes, voters) for prefs (..., voters, options)
+    """
+    if ranks is None:
+        ranks = rankMatrix(prefs)
+    winners = np.stack([votingWinners(prefs, s) for s in schemes], axis=-1)
+    return happinessOf(ranks, winners)
+
+
+def encodePrefs(prefMatrix):
+    """Encode a preference matrix of candidate letters as integers
+
+    Candidates are numbered in lexicographical order, so the lowest index
+    tie-break of the integer engine is the same as the alphabetical
+    tie-break of the string API.
+
+    Returns:
+    (integer preference matrix, array of candidate labels by index)
+    """
+    prefMatrix = np.asarray(prefMatrix)
+    candidates = np.unique(prefMatrix[0])
+    return np.searchsorted(candidates, prefMatrix), candidates
+
+
+def kApproval(k):
+    """Weights of the rule giving one point to each of the top k positions"""
+    def weights(amountOptions):
+        points = np.zeros(amountOptions, dtype=np.int64)
+        points[:k] = 1
+        return points
+    return weights
+
+
+def registerScoringRule(name, weights):
+    """Add a positional scoring rule to VOTING_RULES
+
+    Parameters:
+    name -- name to pass as scheme
+    weights -- function from the amount of options to the integer points
+               of each ballot position, which must not increase down the
+               ballot; scale fractional points to a common denominator
+               so that ties are exact
+    """
+    VOTING_RULES[name] = {'weights': weights}
+    _compiledWeights.cache_clear()
+    clearOutcomeCaches()
+
+
+def registerRule(name, scores):
+    """Add a non-positional rule to VOTING_RULES
+
+    Parameters:
+    name -- name to pass as scheme
+    scores -- function from integer preferences (..., voters, options) to
+              scores (..., options), the winner being the lowest index
+              with the highest score
+    """
+    VOTING_RULES[name] = {'scores': scores}
+    _compiledWeights.cache_clear()
+    clearOutcomeCaches()
+
+
+def _rule(scheme):
+    if scheme in VOTING_RULES:
+        return VOTING_RULES[scheme]
+    if scheme.endswith('-approval') and scheme[:-len('-approval')].isdigit():
+        return {'weights': kApproval(int(scheme[:-len('-approval')]))}
+    raise ValueError(f'Unknown voting scheme: {scheme}')
+
+
+def isPositional(scheme):
+    """Whether the scheme is a positional scoring rule"""
+    return 'weights' in _rule(scheme)
+
+
+@functools.lru_cache(maxsize=None)
+def _compiledWeights(scheme, amountOptions):
+    weights = np.asarray(_rule(scheme)['weights'](amountOptions))
+    if weights.shape != (amountOptions,) or np.any(np.diff(weights) > 0):
+        raise ValueError(f'{scheme} needs one non-increasing weight per position')
+    if np.any(weights != np.round(weights)):
+        # float tallies would make exact ties depend on the summation order
+        raise ValueError(f'{scheme} needs integer weights')
+    weights = weights.astype(np.int64)
+    weights.setflags(write=False)
+    return weights
+
+
+def schemeWeights(scheme, amountOptions):
+    """Points a ballot gives to each of its positions under a scheme
+
+    The weights are compiled once per scheme and amount of options, and
+    are read-only.
+    """
+    if not isPositional(scheme):
+        raise ValueError(f'{scheme} is not a positional scoring rule')
+    return _compiledWeights(scheme, amountOptions)
+
+
+def positionCounts(prefs):
+    """How many voters put each candidate at each position
+
+    Returns:
+    Counts shaped (..., positions, candidates) for prefs (..., voters, options)
+    """
+    prefs = np.asarray(prefs)
+    amountOptions = prefs.shape[-1]
+    flat = prefs.reshape(-1, prefs.shape[-2], amountOptions)
+    # every profile and position gets its own block of candidate bins
+    offsets = (np.arange(flat.shape[0])[:, None, None] * amountOptions
+               + np.arange(amountOptions)) * amountOptions
+    counts = np.bincount((flat + offsets).ravel(), minlength=flat.shape[0] * amountOptions**2)
+    return counts.reshape(prefs.shape[:-2] + (amountOptions, amountOptions))
+
+
+def scoreProfiles(prefs, scheme):
+    """Points per candidate for one profile or a whole batch of profiles
+
+    Positional rules are a product of their weights with the
+    positionCounts, other rules run their own kernel.
+
+    Parameters:
+    prefs -- integer preferences, shaped (voters, options) or
+             (profiles, voters, options)
+    scheme -- name of the voting scheme
+
+    Returns:
+    Scores shaped (options,) or (profiles, options)
+    """
+    prefs = np.asarray(prefs)
+    rule = _rule(scheme)
+    if 'scores' in rule:
+        return rule['scores'](prefs)
+    return schemeWeights(scheme, prefs.shape[-1]) @ positionCounts(prefs)
+
+
+def scoreRules(prefs, schemes):
+    """Scores of several positional rules from one set of position counts
+
+    Returns:
+    Scores shaped (..., schemes, options)
+    """
+    prefs = np.asarray(prefs)
+    weights = np.stack([schemeWeights(s, prefs.shape[-1]) for s in schemes])
+    return weights @ positionCounts(prefs)
+
+
+def pairwiseMajority(prefs):
+    """How many voters prefer each candidate to each other candidate
+
+    Returns:
+    Counts shaped (..., options, options), [c, d] voters ranking c above d
+    """
+    ranks = rankMatrix(prefs)
+    return np.sum(ranks[..., :, None] < ranks[..., None, :], axis=-3)
+
+
+def copelandScores(prefs):
+    """Pairwise wins plus half the pairwise ties of every candidate"""
+    majority = pairwiseMajority(prefs)
+    duels = np.sign(majority - np.swapaxes(majority, -1, -2))
+    return np.sum(duels > 0, axis=-1) + 0.5 * (np.sum(duels == 0, axis=-1) - 1)
+
+
+def runoffScores(prefs):
+    """Plurality with runoff as a one-hot score of the winner
+
+    The two plurality leaders meet in a majority duel, ties going to the
+    lower candidate index both times.
+    """
+    prefs = np.asarray(prefs)
+    plurality = scoreProfiles(prefs, 'VfO')
+    finalists = np.sort(np.argsort(-plurality, axis=-1, kind='stable')[..., :2], axis=-1)
+    majority = pairwiseMajority(prefs)
+    first, second = finalists[..., 0], finalists[..., 1]
+    firstVotes = np.take_along_axis(np.take_along_axis(
+        majority, first[..., None, None], axis=-2)[..., 0, :], second[..., None], axis=-1)[..., 0]
+    winner = np.where(2 * firstVotes >= prefs.shape[-2], first, second)
+    return (np.arange(prefs.shape[-1]) == winner[..., None]).astype(np.float64)
+
+
+def votingWinners(prefs, scheme):
+    """Winner index of one profile or of every profile in a batch
+
+    Ties are broken in favour of the lowest candidate index.
+    """
+    return np.argmax(scoreProfiles(prefs, scheme), axis=-1)
 
 
 def votingResults(prefMatrix, scheme):
-    bordaPoints = np.arange(len(prefMatrix[0]))[::-1]
-    if scheme == "Borda":
-        candidateVotes = dict()
-        for voter in prefMatrix:
-            for i, cand in enumerate(voter):
-                candidateVotes[cand] = candidateVotes.get(cand, 0) + bordaPoints[i]
-        candidates = sorted(candidateVotes.items(), key=lambda t: t[1])[::-1]
-        maxVotes = candidates[0][1]
-    else:
-        if scheme == "VfO":
-            c = Counter(prefMatrix[:, 0])
-        elif scheme == "VfT":
-            c = Counter(prefMatrix[:, :2].reshape(-1))
-        elif scheme == "Veto":
-            c = Counter(prefMatrix[:, :-1].reshape(-1))
-
-        # print(c)
-        # print(f'mostCommon: {c.most_common()}')
-        candidates = c.most_common()
-        maxVotes = c.most_common(1)[0][1]
-
-    # Tie-breaking: Sort winners by lexicographical order
-    winners = []
-    for (candidate, votes) in candidates:
-        if votes < maxVotes:
-            break
-        winners.append(candidate)
-    winner = sorted(winners)[0]
-    return winner
+    intPrefs, candidates = encodePrefs(prefMatrix)
+    return candidates[votingWinners(intPrefs, scheme)]
+
+
+def _allBallots(voter, prefMatrix, intPrefs, candidates, scheme, delta=True):
+    """Every permutation of the voter's ballot together with its winner index
+
+    With delta the points of the other voters are tallied once and only
+    the contribution of the tried ballot is added per permutation, instead
+    of re-running the whole vote for every permutation.
+    """
+    if not delta:
+        import copy
+        for prefs in itertools.permutations(prefMatrix[voter]):
+            newPrefMatrix = copy.copy(prefMatrix)
+            newPrefMatrix[voter] = prefs
+            yield prefs, np.searchsorted(candidates, votingResults(newPrefMatrix, scheme))
+        return
+    weights = schemeWeights(scheme, len(candidates))
+    otherScores = scoreProfiles(intPrefs, scheme)
+    otherScores[intPrefs[voter]] -= weights
+    for prefs, ballot in zip(itertools.permutations(prefMatrix[voter]),
+                             itertools.permutations(intPrefs[voter])):
+        scores = otherScores.copy()
+        scores[list(ballot)] += weights
+        yield prefs, np.argmax(scores)
+
+
+def _sureWinner(low, high):
+    """Candidate that wins whatever the open points turn out to be, or None"""
+    winner = np.argmax(low)
+    index = np.arange(len(low))
+    beats = np.where(index < winner, low[winner] > high, low[winner] >= high)
+    beats[winner] = True
+    return winner if beats.all() else None
+
+
+def _possibleWinners(low, high):
+    """Mask of candidates that win for at least one way of giving the open points"""
+    index = np.arange(len(low))
+    beats = (high[:, None] > low[None, :]) | ((high[:, None] == low[None, :])
+                                              & (index[:, None] < index[None, :]))
+    np.fill_diagonal(beats, True)
+    return beats.all(axis=1)
+
+
+def _ballotClasses(scores, remaining, groups, weights, better, assigned=()):
+    """Classes of ballots whose outcome makes the voter happier
+
+    Ballot positions that award the same points form a group, and a
+    class fixes which candidates fill each of the first groups. The
+    search stops descending as soon as the winner is the same for every
+    ballot of the class, or no candidate the voter prefers can still win.
+
+    Yields:
+    (candidates per assigned group, candidates left for the other
+     positions, winner of every ballot in the class)
+    """
+    low = scores.copy()
+    high = scores.copy()
+    if groups:
+        openWeights = weights[np.concatenate(groups)]
+        low[remaining] += openWeights.min()
+        high[remaining] += openWeights.max()
+    winner = _sureWinner(low, high)
+    if winner is not None:
+        if better[winner]:
+            yield assigned, remaining, winner
+        return
+    if not np.any(better & _possibleWinners(low, high)):
+        return
+    group = groups[0]
+    for chosen in itertools.combinations(remaining, len(group)):
+        newScores = scores.copy()
+        newScores[list(chosen)] += weights[group[0]]
+        rest = [c for c in remaining if c not in chosen]
+        yield from _ballotClasses(newScores, rest, groups[1:], weights, better,
+                                  assigned + (chosen,))
+
+
+@functools.lru_cache(maxsize=OUTCOME_CACHE_SIZE)
+def _strategicClasses(scheme, otherScores, ballot):
+    """Cached _ballotClasses for the voter's sincere ballot and the others' tally
+
+    Voters with the same ballot in the same profile, and repeated
+    profiles, face the same tally, so their classes are only searched
+    once. Both arguments are tuples to make them hashable.
+    """
+    amountOptions = len(ballot)
+    weights = schemeWeights(scheme, amountOptions)
+    scores = np.array(otherScores)
+    position = np.empty(amountOptions, dtype=np.int64)
+    position[list(ballot)] = np.arange(amountOptions)
+    sincere = scores.copy()
+    sincere[list(ballot)] += weights
+    better = position < position[np.argmax(sincere)]
+    groups = np.split(np.arange(amountOptions), np.flatnonzero(np.diff(weights)) + 1)
+    return tuple((assigned, tuple(remaining), int(winner)) for assigned, remaining, winner
+                 in _ballotClasses(scores, list(range(amountOptions)), groups, weights, better))
+
+
+_sincereCache = collections.OrderedDict()
+_sincereCacheCounts = {'hits': 0, 'misses': 0, 'maxsize': OUTCOME_CACHE_SIZE}
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+def _sincereOutcome(scheme, intPrefs):
+    """Cached scores, overall happiness per winner and winner of a profile
+
+    The key is a digest of the sorted ballot counts, so reorderings of the
+    same electorate share an entry, and an entry only holds O(options)
+    values whatever the number of voters. Returns read-only arrays, as
+    they are shared between callers.
+    """
+    import hashlib
+    types, counts = np.unique(intPrefs, axis=0, return_counts=True)
+    digest = hashlib.blake2b(types.astype(np.int64).tobytes() + counts.tobytes()).digest()
+    key = (scheme, intPrefs.shape[1], digest)
+    if key in _sincereCache:
+        _sincereCacheCounts['hits'] += 1
+        _sincereCache.move_to_end(key)
+        return _sincereCache[key]
+    _sincereCacheCounts['misses'] += 1
+    scores = scoreProfiles(intPrefs, scheme)
+    # overall happiness for every possible winner
+    totals = happinessOf(rankMatrix(types), np.arange(intPrefs.shape[1])) @ counts
+    for array in (scores, totals):
+        array.setflags(write=False)
+    _sincereCache[key] = outcome = (scores, totals, np.argmax(scores))
+    while (_sincereCacheCounts['maxsize'] is not None
+           and len(_sincereCache) > _sincereCacheCounts['maxsize']):
+        _sincereCache.popitem(last=False)
+    return outcome
+
+
+def outcomeCacheInfo():
+    """Hit/miss counters and sizes of the outcome caches"""
+    sincere = CacheInfo(_sincereCacheCounts['hits'], _sincereCacheCounts['misses'],
+                        _sincereCacheCounts['maxsize'], len(_sincereCache))
+    return {'sincere': sincere, 'strategic': _strategicClasses.cache_info()}
+
+
+def setOutcomeCacheSize(maxsize):
+    """Bound the outcome caches to maxsize entries each (clears them)"""
+    global _strategicClasses
+    _sincereCache.clear()
+    _sincereCacheCounts.update(hits=0, misses=0, maxsize=maxsize)
+    _strategicClasses = functools.lru_cache(maxsize=maxsize)(_strategicClasses.__wrapped__)
+
+
+def clearOutcomeCaches():
+    """Empty the outcome caches, e.g. after a scheme name got a new rule"""
+    _sincereCache.clear()
+    _strategicClasses.cache_clear()
+
+
+# the built-in rules, registered once the caches they clear exist
+registerScoringRule('VfO', kApproval(1))
+registerScoringRule('VfT', kApproval(2))
+registerScoringRule('Veto', lambda amountOptions: kApproval(amountOptions - 1)(amountOptions))
+registerScoringRule('Borda', lambda amountOptions: np.arange(amountOptions)[::-1])
+# 1/position, scaled to integers by lcm(1..m)
+registerScoringRule('Dowdall', lambda amountOptions: (math.lcm(*range(1, amountOptions + 1))
+                                                      // np.arange(1, amountOptions + 1)))
+registerRule('Copeland', copelandScores)
+registerRule('Runoff', runoffScores)
 
 
-def howShouldVoterLie(voter, prefMatrix, scheme):
-    winnerBefore = votingResults(prefMatrix, scheme)
-    happiness = calcHappiness(winnerBefore, prefMatrix)
+def _prunedBallots(voter, prefMatrix, intPrefs, scheme, ranks, scores):
+    """Only the ballots that make the voter happier, with their winner index
+
+    The ballots come in the same order as itertools.permutations of the
+    voter's preferences, so the result matches a full enumeration.
+    """
+    weights = schemeWeights(scheme, intPrefs.shape[1])
+    otherScores = scores.copy()
+    otherScores[intPrefs[voter]] -= weights
+    position = ranks[voter]
+
+    strategic = []
+    for assigned, remaining, winner in _strategicClasses(scheme, tuple(otherScores.tolist()),
+                                                         tuple(intPrefs[voter].tolist())):
+        parts = [itertools.permutations(chosen) for chosen in assigned]
+        parts.append(itertools.permutations(remaining))
+        for ballot in itertools.product(*parts):
+            order = tuple(position[c] for part in ballot for c in part)
+            strategic.append((order, winner))
+    strategic.sort()
+    for order, winner in strategic:
+        yield tuple(prefMatrix[voter][j] for j in order), winner
+
+
+def howShouldVoterLie(voter, prefMatrix, scheme, delta=True, pruned=True):
+    """Find every ballot that makes the voter happier than voting sincerely
+
+    Parameters:
+    voter -- row of the voter in the preference matrix
+    prefMatrix -- sincere preferences of all voters
+    scheme -- name of the voting scheme
+    delta -- re-tally only the voter's ballot when enumerating
+    pruned -- search classes of ballots with the same outcome instead of
+              trying all m! permutations (pruned=False to verify)
+    Both shortcuts need a positional rule; other rules enumerate and
+    re-run the whole vote.
+
+    The sincere outcome and the strategic classes are memoized in
+    bounded LRU caches, see outcomeCacheInfo.
+    """
+    intPrefs, candidates = encodePrefs(prefMatrix)
+    intPrefs = intPrefs.astype(np.int64)
+    scores, totals, winnerInd = _sincereOutcome(scheme, intPrefs)
+    ranks = rankMatrix(intPrefs)
+    winnerBefore = candidates[winnerInd]
+    happiness = happinessOf(ranks, winnerInd)
     lies = 0
     happinessVoter = happiness[voter]
     sVotingOptions = []
@@ -114,31 +866,433 @@ def howShouldVoterLie(voter, prefMatrix, scheme):
     # print(happinessVoter)
     if happinessVoter == len(prefMatrix[0]) - 1:
         return 0, [prefMatrix[voter]], [winnerBefore], [happinessVoter], [np.sum(happiness)]
+    if not isPositional(scheme):
+        # tallies and point classes only exist for positional rules
+        pruned = delta = False
+    if pruned:
+        ballots = _prunedBallots(voter, prefMatrix, intPrefs, scheme, ranks, scores)
+    else:
+        ballots = _allBallots(voter, prefMatrix, intPrefs, candidates, scheme, delta)
     # bestPrefs = prefMatrix[voter]
-    for prefs in itertools.permutations(prefMatrix[voter]):
-        newPrefMatrix = copy.copy(prefMatrix)
-        newPrefMatrix[voter] = prefs
-        winnerNew = votingResults(newPrefMatrix, scheme)
+    for prefs, winnerNew in ballots:
         # calc happiness with old prefmatrix (just the winner changed)
-        newHappiness = calcHappiness(winnerNew, prefMatrix)
-        newHappinessVoter = newHappiness[voter]
-        if newHappinessVoter > happinessVoter:
-            # happinessVoter = newHappinessVoter
-            lies += 1
-            # bestPrefs = prefs
-            sVotingOptions.append(prefs)
-            # savedWinner = winnerNew
-            winners.append(winnerNew)
-            # savedTotalHappiness = np.sum(newHappiness)
-            voterHappinesses.append(newHappinessVoter)
-            totalHappinesses.append(np.sum(newHappiness))
+        newHappinessVoter = len(candidates) - 1 - ranks[voter, winnerNew]
+        if newHappinessVoter <= happinessVoter:
+            continue
+        # happinessVoter = newHappinessVoter
+        lies += 1
+        # bestPrefs = prefs
+        sVotingOptions.append(prefs)
+        # savedWinner = winnerNew
+        winners.append(candidates[winnerNew])
+        # savedTotalHappiness = np.sum(newHappiness)
+        voterHappinesses.append(newHappinessVoter)
+        totalHappinesses.append(totals[winnerNew])
     if lies != 0:
         return lies, sVotingOptions, winners, voterHappinesses, totalHappinesses
     else:
         return lies, [prefMatrix[voter]], [winnerBefore], [happinessVoter], [np.sum(happiness)]
 
 
-def main():
+def _manipulableVotersByBallots(prefs, scheme):
+    """manipulableVoters for any rule, by trying every ballot"""
+    flat = prefs.reshape((-1,) + prefs.shape[-2:])
+    types = ballotTypes(prefs.shape[-1])
+    result = np.zeros(flat.shape[:2], dtype=bool)
+    for p, profile in enumerate(flat):
+        ranks = rankMatrix(profile)
+        sincere = votingWinners(profile, scheme)
+        for voter in range(len(profile)):
+            lied = np.repeat(profile[None], len(types), axis=0)
+            lied[:, voter] = types
+            newRanks = ranks[voter, votingWinners(lied, scheme)]
+            result[p, voter] = np.any(newRanks < ranks[voter, sincere])
+    return result.reshape(prefs.shape[:-1])
+
+
+def manipulableVoters(prefs, scheme):
+    """Which voters can make a candidate they prefer win by lying
+
+    Gives the same answer as howShouldVoterLie(...)[0] != 0, without
+    trying ballots. A voter can install c iff they can with c on top of
+    the ballot, and then the other candidates must each get one of the
+    remaining points without overtaking c. Every candidate accepts all
+    points below some cap, so that assignment exists iff the k-th most
+    constrained candidate accepts at least k of the remaining points.
+
+    Parameters:
+    prefs -- integer preferences, (voters, options) or
+             (profiles, voters, options)
+
+    Rules that are not positional fall back to scoring all m! ballots of
+    each voter in one batch.
+
+    Returns:
+    Boolean mask shaped like prefs without the options axis
+    """
+    prefs = np.asarray(prefs)
+    if not isPositional(scheme):
+        return _manipulableVotersByBallots(prefs, scheme)
+    amountOptions = prefs.shape[-1]
+    weights = schemeWeights(scheme, amountOptions)
+    ranks = np.argsort(prefs, axis=-1)
+    scores = scoreProfiles(prefs, scheme)
+    winner = np.argmax(scores, axis=-1)
+    otherScores = scores[..., None, :] - weights[ranks]
+    best = otherScores + weights[0]
+    caps = best[..., :, None] - otherScores[..., None, :]
+    # rival d must stay below c when it wins ties against c (d < c)
+    index = np.arange(amountOptions)
+    rest = np.sort(weights[1:])
+    accepted = np.where(index[None, :] < index[:, None],
+                        np.searchsorted(rest, caps, side='left'),
+                        np.searchsorted(rest, caps, side='right'))
+    accepted[..., index, index] = amountOptions
+    accepted = np.sort(accepted, axis=-1)[..., :amountOptions - 1]
+    installable = np.all(accepted >= np.arange(1, amountOptions), axis=-1)
+    better = ranks < np.take_along_axis(ranks, winner[..., None, None].repeat(
+        prefs.shape[-2], axis=-2), axis=-1)
+    return np.any(installable & better, axis=-1)
+
+
+def _greedyCoalitionBallots(base, weights, target, k):
+    """Ballots for k manipulators that try to install target
+
+    Each manipulator in turn puts target first and hands the remaining
+    points, largest first, to the rivals with the lowest running score
+    (rivals winning ties against target counting as slightly higher).
+    """
+    scores = base.copy()
+    rivals = np.array([d for d in range(len(base)) if d != target])
+    ballots = []
+    for _ in range(k):
+        order = rivals[np.lexsort((rivals < target, scores[rivals]))]
+        ballot = np.concatenate(([target], order))
+        scores[ballot] += weights
+        ballots.append(ballot)
+    return ballots, scores
+
+
+def _twoValuedInstalls(base, weights, target, k):
+    """Exact check for rules with two point values (k-approval, VfO, VfT, Veto)
+
+    Every manipulator tops target and gives the high value to t-1 rivals.
+    Rival d can take the high value from at most x_d manipulators without
+    overtaking target, and the coalition succeeds iff all x_d >= 0 and
+    the x_d (each at most k) add up to k(t-1).
+    """
+    high, low = weights[0], weights[-1]
+    t = np.sum(weights == high)
+    best = base[target] + k * high
+    room = (best - base - k * low) / (high - low)
+    index = np.arange(len(base))
+    taken = np.where(index < target, np.ceil(room) - 1, np.floor(room))
+    taken = np.delete(taken, target)
+    return np.all(taken >= 0) and np.sum(np.minimum(taken, k)) >= k * (t - 1)
+
+
+def _coalitionInstalls(base, weights, target, k, exact=False):
+    """Whether k manipulators can make target win on top of the base tally"""
+    if len(np.unique(weights)) <= 2:
+        return _twoValuedInstalls(base, weights, target, k)
+    # score gap: the rivals must be able to absorb the k*sum(w[1:]) points
+    # (ties ignored and a small slack, so it only rules out clear failures)
+    room = np.delete(base[target] + k * weights[0] - base, target)
+    if (np.any(room < k * weights[-1] - 1e-9)
+            or np.sum(np.minimum(room, k * weights[1])) < k * np.sum(weights[1:]) - 1e-9):
+        return False
+    _, scores = _greedyCoalitionBallots(base, weights, target, k)
+    if np.argmax(scores) == target:
+        return True
+    if not exact:
+        return False
+    rest = [d for d in range(len(base)) if d != target]
+    ballots = [np.array((target,) + order) for order in itertools.permutations(rest)]
+    for chosen in itertools.combinations_with_replacement(ballots, k):
+        scores = base.copy()
+        for ballot in chosen:
+            scores[ballot] += weights
+        if np.argmax(scores) == target:
+            return True
+    return False
+
+
+def _supporterGroups(ranks, winner, target):
+    """Voters ranking target above the sincere winner, grouped by sincere ballot"""
+    supporters = np.flatnonzero(ranks[:, target] < ranks[:, winner])
+    if not len(supporters):
+        return []
+    _, group = np.unique(ranks[supporters], axis=0, return_inverse=True)
+    group = group.ravel()
+    return [supporters[group == g] for g in range(group.max() + 1)]
+
+
+def _groupSelections(available, k):
+    """Every way to pick k voters from groups of the given sizes, as counts per group"""
+    if not available:
+        if k == 0:
+            yield ()
+        return
+    rest = sum(available[1:])
+    for take in range(max(0, k - rest), min(k, available[0]) + 1):
+        for tail in _groupSelections(available[1:], k - take):
+            yield (take,) + tail
+
+
+def _coalitionMargin(base, weights, target, k):
+    """Lead of target over its closest rival after the greedy coalition ballots
+
+    Rivals winning ties against target need one point less to beat it,
+    so target wins iff the margin is at least 0.
+    """
+    _, scores = _greedyCoalitionBallots(base, weights, target, k)
+    rivals = np.array([d for d in range(len(base)) if d != target])
+    return np.min(scores[target] - scores[rivals] - (rivals < target))
+
+
+def _minimalCoalitions(prefs, scheme, coalition='supporters', exact=False):
+    """Smallest coalition installing each candidate in one integer profile
+
+    Members only matter through their sincere ballot, so coalitions are
+    tried as counts of members per group of identical supporters (see
+    minimalCoalitions for how they are chosen).
+
+    Returns:
+    (sizes with 0 for the sincere winner and -1 if no coalition of the
+     given type was found, coalition members per candidate)
+    """
+    if coalition not in ('supporters', 'identical'):
+        raise ValueError(f'Unknown coalition type: {coalition}')
+    amountOptions = prefs.shape[-1]
+    weights = schemeWeights(scheme, amountOptions)
+    ranks = rankMatrix(prefs)
+    contrib = weights[ranks]
+    scores = contrib.sum(axis=0)
+    winner = np.argmax(scores)
+    sizes = np.full(amountOptions, -1)
+    sizes[winner] = 0
+    members = {winner: np.array([], dtype=np.int64)}
+    for target in range(amountOptions):
+        if target == winner:
+            continue
+        groups = _supporterGroups(ranks, winner, target)
+        if not groups:
+            continue
+        groupContrib = np.array([contrib[group[0]] for group in groups])
+        available = [len(group) for group in groups]
+        counts = np.zeros(len(groups), dtype=np.int64)
+        for k in range(1, sum(available) + 1):
+            if coalition == 'identical':
+                selections = [tuple(k * (g == h) for h in range(len(groups)))
+                              for g in range(len(groups)) if available[g] >= k]
+            elif exact:
+                selections = _groupSelections(available, k)
+            else:
+                # add the supporter whose sincere ballot leaves the rivals the most room
+                options = np.flatnonzero(counts < available)
+                margins = []
+                for g in options:
+                    counts[g] += 1
+                    margins.append(_coalitionMargin(scores - counts @ groupContrib,
+                                                    weights, target, k))
+                    counts[g] -= 1
+                counts[options[np.argmax(margins)]] += 1
+                selections = [tuple(counts)]
+            for selection in selections:
+                base = scores - np.array(selection) @ groupContrib
+                if _coalitionInstalls(base, weights, target, k, exact):
+                    sizes[target] = k
+                    members[target] = np.sort(np.concatenate(
+                        [group[:c] for group, c in zip(groups, selection)]))
+                    break
+            if sizes[target] != -1:
+                break
+    return sizes, members
+
+
+def minimalCoalitions(prefs, scheme, coalition='supporters', exact=False):
+    """Smallest coalition that can install each candidate, for whole sweeps
+
+    A coalition replaces its members' sincere ballots by coordinated
+    ballots. By default the members are recruited one at a time, each
+    time the supporter whose sincere ballot leaves the rivals the most
+    room, and the ballots are checked exactly for rules with two point
+    values (VfO, VfT, Veto, k-approval) and built greedily for other
+    positional rules. The sizes are then upper bounds, and -1 only means
+    that no coalition was found. With exact every choice of members and
+    every joint ballot is tried, which gives the minimal sizes but is
+    exponential.
+
+    Parameters:
+    prefs -- integer preferences, (voters, options) or
+             (profiles, voters, options)
+    coalition -- 'supporters' (voters preferring the candidate to the
+                 sincere winner) or 'identical' (voters with the same
+                 sincere ballot)
+
+    Returns:
+    Sizes shaped (..., options): 0 for the sincere winner, -1 if no
+    coalition of that type installing the candidate was found; only
+    with exact does -1 mean that none exists
+    """
+    prefs = np.asarray(prefs)
+    flat = prefs.reshape((-1,) + prefs.shape[-2:])
+    sizes = np.stack([_minimalCoalitions(p, scheme, coalition, exact)[0] for p in flat])
+    return sizes.reshape(prefs.shape[:-2] + (prefs.shape[-1],))
+
+
+def coalitionManipulation(prefMatrix, scheme, coalition='supporters', exact=False):
+    """Smallest coalition and its ballots installing each candidate
+
+    See minimalCoalitions for the coalition types and for exact.
+
+    Returns:
+    {candidate: (size, voters, ballots)} or {candidate: None} if no
+    coalition of that type installing the candidate was found; only
+    with exact does None mean that none exists
+    """
+    intPrefs, candidates = encodePrefs(prefMatrix)
+    sizes, members = _minimalCoalitions(intPrefs, scheme, coalition, exact)
+    weights = schemeWeights(scheme, len(candidates))
+    scores = scoreProfiles(intPrefs, scheme)
+    result = {}
+    for target, size in enumerate(sizes):
+        if size == -1:
+            result[candidates[target]] = None
+            continue
+        voters = members[target]
+        base = scores - np.sum(weights[rankMatrix(intPrefs[voters])], axis=0)
+        ballots, final = _greedyCoalitionBallots(base, weights, target, size)
+        if size and np.argmax(final) != target:
+            # only the exhaustive search found these ballots
+            ballots = None
+        else:
+            ballots = [tuple(candidates[b]) for b in ballots]
+        result[candidates[target]] = (int(size), voters.tolist(), ballots)
+    return result
+
+
+def readPrefLib(path):
+    """Read one PrefLib .soc or .soi election as integer preferences
+
+    Both the current format (# headers, "count: a,b,c" rows) and the old
+    one (number of alternatives, names, totals, "count,a,b,c" rows) are
+    read. Orders are repeated by their count, candidates are numbered
+    from 0. Incomplete .soi ballots are completed by appending the
+    unranked candidates in index order.
+
+    Returns:
+    prefs with shape (voters, options)
+    """
+    with open(path) as file:
+        lines = [line.strip() for line in file if line.strip()]
+    if lines[0].startswith('#'):
+        header = [line for line in lines if line.startswith('#')]
+        rows = [line.replace(':', ',') for line in lines if not line.startswith('#')]
+        amountOptions = next(int(line.split(':')[1]) for line in header
+                             if line.upper().startswith('# NUMBER ALTERNATIVES'))
+    else:
+        amountOptions = int(lines[0])
+        rows = lines[amountOptions + 2:]
+    if path.endswith('.soc'):
+        table = np.loadtxt(rows, delimiter=',', dtype=np.int64, ndmin=2)
+        if table.shape[1] != amountOptions + 1:
+            raise ValueError(f'{path}: .soc orders must rank all {amountOptions} alternatives')
+        return np.repeat(table[:, 1:] - 1, table[:, 0], axis=0)
+    counts = np.empty(len(rows), dtype=np.int64)
+    orders = np.empty((len(rows), amountOptions), dtype=np.int64)
+    for r, row in enumerate(rows):
+        order = np.array(row.split(','), dtype=np.int64)
+        counts[r] = order[0]
+        ranked = order[1:] - 1
+        unranked = np.ones(amountOptions, dtype=bool)
+        unranked[ranked] = False
+        orders[r] = np.concatenate([ranked, np.flatnonzero(unranked)])
+    return np.repeat(orders, counts, axis=0)
+
+
+def loadProfiles(paths, chunksize=1024):
+    """Read profiles from files in batches of equal shape
+
+    .npy files hold integer preferences (profiles, voters, options) or
+    (voters, options) and are memory-mapped, so only one batch is in
+    memory at a time. .soc/.soi files hold one PrefLib election each;
+    they are grouped by (voters, options) and a group is yielded once it
+    holds chunksize profiles, the rest at the end.
+
+    Yields:
+    (labels, prefs) with one label per profile and prefs shaped
+    (profiles, voters, options)
+    """
+    groups = collections.defaultdict(lambda: ([], []))
+    for path in paths:
+        if path.endswith('.npy'):
+            dump = np.load(path, mmap_mode='r')
+            if dump.ndim == 2:
+                dump = dump[None]
+            if dump.ndim != 3:
+                raise ValueError(f'{path}: expected (profiles, voters, options), got {dump.shape}')
+            for start in range(0, len(dump), chunksize):
+                stop = min(start + chunksize, len(dump))
+                yield [f'{path}:{p}' for p in range(start, stop)], np.asarray(dump[start:stop])
+        elif path.endswith(('.soc', '.soi')):
+            prefs = readPrefLib(path)
+            labels, batch = groups[prefs.shape]
+            labels.append(path)
+            batch.append(prefs)
+            if len(batch) == chunksize:
+                yield labels, np.stack(batch)
+                del groups[prefs.shape]
+        else:
+            raise ValueError(f'Unknown profile file type: {path}')
+    for labels, batch in groups.values():
+        yield labels, np.stack(batch)
+
+
+def batchRisk(prefs, schemes):
+    """Winner, overall happiness and risk of a batch of profiles
+
+    The risk is our definition from analyseProfile: the share of voters
+    that can make a candidate they prefer win by lying.
+
+    Parameters:
+    prefs -- integer preferences (profiles, voters, options)
+
+    Returns:
+    {scheme: (winners, overallHappiness, risk)}, each shaped (profiles,)
+    """
+    ranks = rankMatrix(prefs)
+    result = {}
+    for scheme in schemes:
+        winners = votingWinners(prefs, scheme)
+        happiness = happinessOf(ranks, winners)
+        risk = np.mean(manipulableVoters(prefs, scheme), axis=-1)
+        result[scheme] = (winners, np.sum(happiness, axis=-1), risk)
+    return result
+
+
+def batchAnalysis(paths, schemes, report, chunksize=1024):
+    """Report the risk of every profile in the given files
+
+    Writes one line / record per profile and scheme. Winners are
+    candidate indices, numbered from 0 as in the .npy files.
+    """
+    printf('profile\tvoters\toptions\tscheme\twinner\toverallHappiness\trisk', report)
+    for labels, prefs in loadProfiles(paths, chunksize):
+        amountVoters, amountOptions = prefs.shape[1:]
+        results = batchRisk(prefs, schemes)
+        for p, label in enumerate(labels):
+            for scheme in schemes:
+                winners, happiness, risk = results[scheme]
+                printf(f'{label}\t{amountVoters}\t{amountOptions}\t{scheme}\t'
+                       f'{winners[p]}\t{happiness[p]}\t{risk[p]}', report)
+                report.record(profile=label, voters=amountVoters, options=amountOptions,
+                              scheme=scheme, winner=int(winners[p]),
+                              overallHappiness=int(happiness[p]), risk=float(risk[p]))
+
+
+def main(fmt='txt', votingSchemes=None, output=None):
+    """Report the built-in example, by default to <schemes>.<fmt>"""
     # example of a preference matrix
     ##### ENTER YOUR PREFERENCEMATRIX HERE #####
     prefMatrix = np.array([['B', 'F', 'A', 'C', 'E', 'D'],
@@ -148,15 +1302,28 @@ def main():
                            ['E', 'B', 'F', 'D', 'C', 'A']])
     # possible voting schemes
     ##### SELECT YOUR VOTING SCHEME HERE ######
-    votingSchemes = ["VfO", "VfT", "Veto", "Borda"]
-    # votingSchemes = ["VfO", "Veto"]
-    printf(f"Non Strategic Outcome: ")
+    if votingSchemes is None:
+        votingSchemes = ["VfO", "VfT", "Veto", "Borda"]
+        # votingSchemes = ["VfO", "Veto"]
+    if output is None:
+        output = f'{"".join(votingSchemes)}.{fmt}'
+    with ReportSink(output, fmt) as report:
+        analyseProfile(prefMatrix, votingSchemes, report)
+
+
+def analyseProfile(prefMatrix, votingSchemes, report, profile=None):
+    """Report the strategic-voting options of every voter under every scheme
+
+    A profile number, if given, is added to every record.
+    """
+    extra = {} if profile is None else {'profile': profile}
+    printf(f"Non Strategic Outcome: ", report)
     for scheme in votingSchemes:
-        printf(f'Scheme: {scheme}')
+        printf(f'Scheme: {scheme}', report)
         winner = votingResults(prefMatrix, scheme)
         happiness = calcHappiness(winner, prefMatrix)
-        printf(f'Winner: {winner}')
-        printf(f'Overall Happiness: {np.sum(happiness)}')
+        printf(f'Winner: {winner}', report)
+        printf(f'Overall Happiness: {np.sum(happiness)}', report)
         numLyingVoters = 0
         numLyingOptions = 0
         for i, voter in enumerate(prefMatrix):
@@ -164,21 +1331,26 @@ def main():
             if voterLies != 0:
                 numLyingVoters += 1
                 numLyingOptions += voterLies
-                printf(f'\nVoter {i} real preferences {prefMatrix[i]}')
+                printf(f'\nVoter {i} real preferences {prefMatrix[i]}', report)
                 for x in range(voterLies):
                     printf(f'Voter {i} modified prefList: {sVotingOptions[x]},'
                            + f' new Winner: {winners[x]}, new overall Happiness: {totalHappinesses[x]},'
-                           + f' Reason: happiness increase: {happiness[i]} --> {voterHappinesses[x]}')
-                    if winners[x] in sVotingOptions[x][:np.where(prefMatrix[i] == winners[x])[0][0]]:
-                        printf('Compromise')
-                    if winner in sVotingOptions[x][np.where(prefMatrix[i] == winner)[0][0]+1:]:
-                        printf('Burying')
-
-        printf(f'Risk of strategic voting (taken from assignment): {numLyingOptions/prefMatrix.shape[0]}')
-        printf(f'Our definition of strategic voting: {numLyingVoters/prefMatrix.shape[0]}')
-        printf()
+                           + f' Reason: happiness increase: {happiness[i]} --> {voterHappinesses[x]}', report)
+                    compromise = winners[x] in sVotingOptions[x][:np.where(prefMatrix[i] == winners[x])[0][0]]
+                    burying = winner in sVotingOptions[x][np.where(prefMatrix[i] == winner)[0][0]+1:]
+                    if compromise:
+                        printf('Compromise', report)
+                    if burying:
+                        printf('Burying', report)
+                    report.record(scheme=scheme, voter=i, preferences=''.join(prefMatrix[i]),
+                                  ballot=''.join(sVotingOptions[x]), winner=str(winners[x]),
+                                  sincereWinner=str(winner), overallHappiness=int(totalHappinesses[x]),
+                                  happinessBefore=int(happiness[i]), happinessAfter=int(voterHappinesses[x]),
+                                  compromise=bool(compromise), burying=bool(burying), **extra)
 
-    writeOutToFile(votingSchemes)
+        printf(f'Risk of strategic voting (taken from assignment): {numLyingOptions/prefMatrix.shape[0]}', report)
+        printf(f'Our definition of strategic voting: {numLyingVoters/prefMatrix.shape[0]}', report)
+        printf(report=report)
 
 # Possibly empty set of strategic-voting options 𝑆={𝑠𝑖},𝑖∈𝑛.
 # A strategic-voting option for voter 𝑖 is a tuple 𝑠𝑖=(𝑣,𝑂̃,𝐻̃,𝑧),
@@ -193,17 +1365,164 @@ def main():
 # print(calcHappiness('B', prefMatrix))
 
 
-def printf(string='\n'):
-    global OUTPUT
-    OUTPUT += string + '\n'
+class ReportSink:
+    """Streams a report to disk while it is being produced
+
+    'txt' writes the human-readable lines, 'jsonl' one JSON object per
+    strategic-voting option and 'parquet' the same records as columns
+    (needs pyarrow). Text and JSON Lines are flushed line by line so the
+    file can be tailed; Parquet is written one row group of batchSize
+    records at a time. Memory stays bounded by one batch. The path '-'
+    writes text or JSON Lines to stdout; Parquet needs a file.
+    """
+
+    def __init__(self, path, fmt='txt', batchSize=10000):
+        if fmt not in ('txt', 'jsonl', 'parquet'):
+            raise ValueError(f'Unknown report format: {fmt}')
+        if fmt == 'parquet' and path == '-':
+            raise ValueError('Parquet reports cannot be written to stdout')
+        self.path = path
+        self.fmt = fmt
+        self.batchSize = batchSize
+        self._columns = collections.defaultdict(list)
+        self._rows = 0
+        self._writer = None
+        self._file = None
+        if fmt == 'parquet':
+            import pyarrow
+            import pyarrow.parquet
+            self._arrow = pyarrow
+            return
+        if fmt == 'jsonl':
+            import json
+            self._json = json
+        if path == '-':
+            self._file = sys.stdout
+        else:
+            self._file = open(path, 'w', buffering=1)
+
+    def line(self, string=''):
+        if self.fmt == 'txt':
+            self._file.write(string + '\n')
+
+    def record(self, **fields):
+        if self.fmt == 'jsonl':
+            self._file.write(self._json.dumps(fields) + '\n')
+        elif self.fmt == 'parquet':
+            for key, value in fields.items():
+                self._columns[key].append(value)
+            self._rows += 1
+            if self._rows >= self.batchSize:
+                self._flushColumns()
+
+    def _flushColumns(self):
+        if not self._rows:
+            return
+        table = self._arrow.table(dict(self._columns))
+        if self._writer is None:
+            self._writer = self._arrow.parquet.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+        self._columns.clear()
+        self._rows = 0
+
+    def close(self):
+        if self.fmt == 'parquet':
+            self._flushColumns()
+            if self._writer is not None:
+                self._writer.close()
+        elif self._file is not sys.stdout:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def printf(string='\n', report=None):
+    """Write a line of the report, or print it without one"""
+    if report is None:
+        print(string)
+    else:
+        report.line(string)
+
+def readProfiles(lines):
+    """Parse preference profiles, one ballot per line
+
+    A ballot lists the candidates from most to least preferred, as
+    letters optionally separated by spaces or commas. Blank lines separate
+    profiles and lines starting with # are ignored. Every ballot of a
+    profile must rank the same candidates, each once, or a ValueError
+    naming the line is raised.
+
+    Yields:
+    One preference matrix (array of letters) per profile
+    """
+    ballots = []
+    for number, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if line:
+            ballot = [c for c in line if c not in ' ,\t']
+            if len(set(ballot)) != len(ballot):
+                raise ValueError(f'Line {number}: ballot {"".join(ballot)} ranks a candidate twice')
+            if ballots and sorted(ballot) != sorted(ballots[0]):
+                raise ValueError(f'Line {number}: ballot {"".join(ballot)} does not rank the '
+                                 f'candidates {"".join(sorted(ballots[0]))} of its profile')
+            ballots.append(ballot)
+        elif ballots:
+            yield np.array(ballots)
+            ballots = []
+    if ballots:
+        yield np.array(ballots)
+
 
+def cli(argv=None):
+    """Command line entry point, see --help"""
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Report the strategic-voting options of preference profiles. '
+                    'Without input the built-in example is analysed.')
+    parser.add_argument('input', nargs='?',
+                        help="file with profiles (see readProfiles), '-' for stdin")
+    parser.add_argument('-s', '--schemes', nargs='+', default=['VfO', 'VfT', 'Veto', 'Borda'],
+                        help='voting schemes to analyse (default: %(default)s)')
+    parser.add_argument('-f', '--format', default='txt', choices=['txt', 'jsonl', 'parquet'],
+                        help='report format (default: %(default)s)')
+    parser.add_argument('-o', '--output',
+                        help="report file, '-' for stdout (default, not for parquet; "
+                             "the built-in example goes to <schemes>.<format>)")
+    parser.add_argument('-b', '--batch', nargs='+', metavar='FILE',
+                        help='report only the risk of every profile in these .soc, .soi '
+                             'or .npy files (see loadProfiles)')
+    parser.add_argument('--chunksize', type=int,
+                        help='profiles per vectorized batch of --batch (default: 1024)')
+    args = parser.parse_args(argv)
+    if args.chunksize is not None and not args.batch:
+        parser.error('--chunksize only applies to --batch')
+    output = args.output
+    if output is None and (args.batch or args.input):
+        output = '-'
+    if args.format == 'parquet' and output == '-':
+        parser.error('parquet reports need a file, pass -o FILE')
 
-def writeOutToFile(scheme):
-    global OUTPUT
-    name = ''.join(scheme)
-    with open(f'{name}.txt', 'w') as f:
-        f.write(OUTPUT)
-    OUTPUT = ''
+    if args.batch:
+        with ReportSink(output, args.format) as report:
+            batchAnalysis(args.batch, args.schemes, report, args.chunksize or 1024)
+        return 0
+    if args.input is None:
+        main(args.format, args.schemes, output)
+        return 0
+    source = sys.stdin if args.input == '-' else open(args.input)
+    with source, ReportSink(output, args.format) as report:
+        try:
+            for k, prefMatrix in enumerate(readProfiles(source)):
+                printf(f'Profile {k}', report)
+                analyseProfile(prefMatrix, args.schemes, report, profile=k)
+        except ValueError as error:
+            parser.error(f'{args.input}: {error}')
+    return 0
 
 
-main()
+if __name__ == '__main__':
+    sys.exit(cli())